@@ -1,5 +1,6 @@
-import io
+import glob
 import logging
+import os
 
 import pubsub.pub
 
@@ -7,37 +8,92 @@ import application.services.afas
 import application.services.data_export.native
 import application.services.data_import.native
 import application.services.data_import.rabobank
+import application.services.recategorization
 import infrastructure.repositories
 import infrastructure.repositories.account_repository
 import infrastructure.repositories.category_repository
-from application.services.transaction_mapping import CategoryCleanupTransactionMapper, map_transaction, \
-    InternalTransactionsMapper, MyInternalTransactionDetector
+import infrastructure.repositories.table_export
 from domain.account_management.model.account import account_repository
 from domain.account_management.model.category import category_repository, category_factory
 
 RABOBANK = "Rabobank"
+NATIVE_TABLES = ["accounts", "categories", "transactions"]
+BINARY_DUMP_FILENAME = "native.dump"
 logger = logging.getLogger(__name__)
 
 
-def export_native_data(account_file, transaction_file, category_file):
-    application.services.data_export.native.export_categories(category_repository().get_categories(), category_file)
-    application.services.data_export.native.export_accounts(account_repository().get_accounts(), account_file,
-                                                            transaction_file)
+def export_native_table(table, filename):
+    """Streams given table ('accounts', 'categories' or 'transactions') from the database to given native csv-file (or
+    to stdout if filename is '-'). Only the database needs to be initialized (see initialize_database)."""
+    application.services.data_export.native.export_rows(infrastructure.repositories.table_export.get_fieldnames(table),
+                                                        infrastructure.repositories.table_export.iter_rows(
+                                                            infrastructure.repositories.blackboard.database(), table),
+                                                        filename)
 
 
 def import_native_data(account_file, transaction_file, category_file):
     application.services.data_import.native.import_categories(category_file)
     application.services.data_import.native.import_accounts(account_file)
-    application.services.data_import.native.import_transactions(transaction_file)
-
-
-def import_rabobank_transactions(filename_list):
-    for csv in filename_list:
-        application.services.data_import.rabobank.import_transactions_from_rabobank_csv(csv, RABOBANK)
-
-
-def import_rabobank_transactions_from_csv(csv_string):
-    application.services.data_import.rabobank.import_transactions_from_rabobank_text(io.StringIO(csv_string), RABOBANK)
+    application.services.data_import.native.restore_transactions(transaction_file)
+    # Restored transactions do not publish domain events, so the aggregates must be rebuilt
+    application.services.Services.aggregate_cube().rebuild(account_repository().get_accounts())
+
+
+def import_rabobank_transactions(path_list):
+    """Imports given Rabobank csv-files, and all csv-files in given directories, in parallel."""
+    filename_list = []
+    for path in path_list:
+        if os.path.isdir(path):
+            filename_list.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            filename_list.append(path)
+    application.services.data_import.rabobank.import_transactions_from_rabobank_csv_files(
+        filename_list, RABOBANK, application.services.Services.categorization_pipeline())
+    log_mapping_statistics()
+
+
+def log_mapping_statistics():
+    """Logs the calls, matches and latencies of the transaction mappers since the previous summary (if any transactions
+    were mapped), and resets them."""
+    statistics = application.services.Services.mapping_statistics()
+    if not statistics.transactions:
+        return
+    statistics.log_summary()
+    memoized_pattern_mapper = application.services.Services.memoized_pattern_mapper()
+    logger.info("Memoized pattern scores: %s, hit rate %.1f%%", memoized_pattern_mapper.cache_info(),
+                memoized_pattern_mapper.get_hit_rate() * 100)
+    statistics.reset()
+
+
+def start_rabobank_import_job(filename):
+    """Imports given (uploaded) Rabobank csv-file in the background and returns the ImportJob that reports its progress.
+    The file is removed when the import has finished."""
+    return application.services.Services.import_jobs().submit(filename, _import_rabobank_upload)
+
+
+def get_import_job(job_id):
+    return application.services.Services.import_jobs().get_job(job_id)
+
+
+def _import_rabobank_upload(filename, statistics):
+    with open(filename, encoding="utf-8", newline="") as csv_text:
+        application.services.data_import.rabobank.import_transactions_from_rabobank_text(
+            csv_text, RABOBANK, application.services.Services.categorization_pipeline(), statistics)
+    log_mapping_statistics()
+
+
+def recategorize_transactions(start_date=None, end_date=None, dry_run=False, processes=None):
+    """Re-applies the transaction mappers to the stored transactions that fall after given start_date (inclusive) and
+    before given end_date (exclusive), if given. Only the transactions of which the category (or internal flag)
+    changes are saved, unless dry_run is set. Returns the list of CategoryChanges."""
+    services = application.services.Services
+    transactions = application.services.get_transactions(start_date, end_date)
+    # A new AFAS mapper, as every AFAS transaction is used only once
+    mappers = [application.services.afas.AfasTransactionCategoryMapper(services.config()), services.cleanup_mapper(),
+               services.internal_transactions_mapper()]
+    return application.services.recategorization.recategorize(transactions, services.pattern_mapper(), mappers,
+                                                               services.internal_transactions_detector(), dry_run,
+                                                               processes)
 
 
 def generate_category(qualified_name):
@@ -46,7 +102,7 @@ def generate_category(qualified_name):
 
 
 def generate_categories(categories_file):
-    with open(categories_file) as text:
+    with open(categories_file) as text, category_repository().batch():
         for qualified_name in text:
             qualified_name = qualified_name.strip()
             if qualified_name:
@@ -58,34 +114,41 @@ def on_transaction_categorized_event(event):
                  event.new_category, event.transaction)
 
 
-def flag_internal_transaction(transaction, internal_transactions_detector):
-    if internal_transactions_detector.is_internal_transaction(transaction):
-        logger.debug("Flagging transaction as internal: %s", transaction)
-        transaction.set_internal(True)
-        account_repository().save_transaction(transaction)
+def export_native_binary(filename):
+    """Streams all tables from the database to given binary dump. Only the database needs to be initialized."""
+    db = infrastructure.repositories.blackboard.database()
+    tables = {}
+    for table in ["accounts", "categories"]:
+        fieldnames = infrastructure.repositories.table_export.get_fieldnames(table)
+        tables[table] = [dict(zip(fieldnames, row))
+                         for row in infrastructure.repositories.table_export.iter_rows(db, table)]
+    application.services.data_export.native.export_binary(
+        tables["accounts"], tables["categories"],
+        infrastructure.repositories.table_export.iter_rows(db, "transactions"), filename)
 
 
-def on_transaction_created_event(event):
-    logger.debug("Categorizing new transaction: %s", event.transaction)
-    pattern_transaction_mapper = application.services.Services.pattern_mapper()
-    afas_transaction_mapper = application.services.Services.afas_mapper()
-    cleanup_transaction_mapper = application.services.Services.cleanup_mapper()
-    internal_transactions_mapper = application.services.Services.internal_transactions_mapper()
+def import_native_binary(filename):
+    application.services.data_import.native.restore_binary(filename)
+    # Restored transactions do not publish domain events, so the aggregates must be rebuilt
+    application.services.Services.aggregate_cube().rebuild(account_repository().get_accounts())
 
-    map_transaction(event.transaction, pattern_transaction_mapper)
-    map_transaction(event.transaction, afas_transaction_mapper)
-    map_transaction(event.transaction, cleanup_transaction_mapper)
-    map_transaction(event.transaction, internal_transactions_mapper)
 
-    internal_transactions_detector = MyInternalTransactionDetector()
-    flag_internal_transaction(event.transaction, internal_transactions_detector)
+def initialize_database():
+    """Initializes the database, without loading the repositories."""
+    infrastructure.repositories.init()
 
 
 def initialize_application():
-    infrastructure.repositories.init()
+    initialize_database()
     infrastructure.repositories.account_repository.init()
     infrastructure.repositories.category_repository.init()
     pubsub.pub.subscribe(on_transaction_categorized_event, "TransactionCategorizedEvent")
-    pubsub.pub.subscribe(on_transaction_created_event, "TransactionCreatedEvent")
+    pubsub.pub.subscribe(application.services.Services.classifier_mapper().on_transaction_categorized_event,
+                         "TransactionCategorizedEvent")
     if not category_repository().get_categories():
         generate_categories(application.services.Services.config().get_file("categories.txt"))
+
+    aggregate_cube = application.services.Services.aggregate_cube()
+    aggregate_cube.rebuild(account_repository().get_accounts())
+    for topic in ["TransactionCreatedEvent", "TransactionCategorizedEvent", "TransactionSetInternalEvent"]:
+        pubsub.pub.subscribe(aggregate_cube.on_transaction_event, topic)
@@ -1,4 +1,5 @@
 import datetime
+import functools
 import logging
 import os
 
@@ -7,41 +8,76 @@ import dateutil.relativedelta
 from dependency_injector import containers, providers
 
 import application.services.transaction_mapping
-from domain.account_management.model.account import account_repository
-from . import afas
+from domain.account_management.model.account import account_repository, get_period
+from . import afas, aggregates, classifier, import_jobs, mapping_statistics
 
 logger = logging.getLogger(__name__)
 
 
+def _locked(function):
+    """Decorates a function that reads the accounts, transactions or aggregate cube, to run it while holding the lock
+    of the account repository, so that it does not read them while an import (in another thread) changes them."""
+    @functools.wraps(function)
+    def locked_function(*args, **kwargs):
+        with account_repository().lock():
+            return function(*args, **kwargs)
+    return locked_function
+
+
 def get_combined_balance_at(date):
-    accounts = account_repository().get_accounts()
-    balance = 0
-    for account in accounts:
-        balance += account.get_balance_at(date)
-    return float(balance)
+    return get_combined_balance_series([date])[0]
+
+
+@_locked
+def get_combined_balance_series(date_list):
+    """Returns the list of combined balances of all accounts at each of given dates. Every account is swept once, in
+    date order."""
+    balances = [0] * len(date_list)
+    for account in account_repository().get_accounts():
+        for index, balance in enumerate(account.get_balances_at(date_list)):
+            balances[index] += balance
+    return [float(balance) for balance in balances]
 
 
 def get_combined_amount_for_category(category, date, mode='monthly'):
-    if mode == 'monthly':
-        date_delta = dateutil.relativedelta.relativedelta(months=1)
-    else:
-        date_delta = dateutil.relativedelta.relativedelta(years=1)
+    return get_combined_amount_series_for_category(category, [date], mode)[0]
 
-    accounts = account_repository().get_accounts()
-    amount = 0
-    for account in accounts:
-        amount += account.get_combined_amount_for_category(category, date, mode)
-    return float(amount)
+
+@_locked
+def get_combined_amount_series_for_category(category, date_list, mode='monthly'):
+    """Returns the list of combined amounts of transactions of given category (or its subcategories) in the month (or
+    year, if mode is not 'monthly') of each of given dates."""
+    periods = [get_period(date, mode) for date in date_list]
+    aggregate_cube = Services.aggregate_cube()
+    if aggregate_cube.initialized:
+        return [cents / 100 for cents in aggregate_cube.get_category_amounts(category, periods)]
+
+    return [float(sum([t.amount for t in get_transactions_for_category(start_date, end_date, category)]))
+            for start_date, end_date in periods]
 
 
 def get_combined_amount_for_category_in_month(category, date):
-    accounts = account_repository().get_accounts()
-    amount = 0
-    for account in accounts:
-        amount += account.get_combined_amount_for_category_in_month(category, date)
-    return float(amount)
+    return get_combined_amount_for_category(category, date, 'monthly')
 
 
+@_locked
+def get_combined_amount_for_category_in_period(category, start_date, end_date):
+    """Returns the combined amount of transactions of given category (or its subcategories) that fall after given
+    start_date (inclusive) and before given end_date (exclusive). Whole months are read from the aggregate cube, only
+    the transactions in the partial months at either end are summed individually."""
+    aggregate_cube = Services.aggregate_cube()
+    first_month = start_date if start_date.day == 1 else get_period(start_date)[1]
+    last_month = get_period(end_date)[0]
+    if not aggregate_cube.initialized or first_month >= last_month:
+        return float(sum([t.amount for t in get_transactions_for_category(start_date, end_date, category)]))
+
+    amount = aggregate_cube.get_category_amounts(category, [(first_month, last_month)])[0] / 100
+    edge_transactions = get_transactions_for_category(start_date, first_month, category) + \
+        get_transactions_for_category(last_month, end_date, category)
+    return amount + float(sum([t.amount for t in edge_transactions]))
+
+
+@_locked
 def get_transactions(start_date, end_date):
     accounts = account_repository().get_accounts()
     transactions = []
@@ -50,6 +86,7 @@ def get_transactions(start_date, end_date):
     return transactions
 
 
+@_locked
 def get_transactions_for_category(start_date, end_date, category):
     accounts = account_repository().get_accounts()
     transactions = []
@@ -58,6 +95,7 @@ def get_transactions_for_category(start_date, end_date, category):
     return transactions
 
 
+@_locked
 def get_date_of_first_transaction():
     """Returns the date of the first transaction for all accounts."""
     accounts = account_repository().get_accounts()
@@ -69,6 +107,7 @@ def get_date_of_first_transaction():
     return first_date
 
 
+@_locked
 def get_date_of_last_transaction():
     """Returns the date of the last transaction for all accounts."""
     accounts = account_repository().get_accounts()
@@ -112,23 +151,30 @@ def get_transaction_date_range(start_date=None, end_date=None, day_nr=1, mode='m
     return dates
 
 
+@_locked
 def get_income_expenses_profit_loss(date_list, mode='monthly'):
     if mode == 'monthly':
         date_delta = dateutil.relativedelta.relativedelta(months=1)
     else:
         date_delta = dateutil.relativedelta.relativedelta(years=1)
 
-    transactions = [get_transactions(date, date + date_delta) for date in date_list]
-
-    income = []
-    expenses = []
-    for transaction_list in transactions:
-        income_transactions = [t.amount for t in transaction_list if t.amount > 0 and not t.internal]
-        expenses_transactions = [t.amount for t in transaction_list if t.amount < 0 and not t.internal]
-        income.append(
-            sum(income_transactions))
-        expenses.append(
-            sum(expenses_transactions))
+    periods = [(date, date + date_delta) for date in date_list]
+    aggregate_cube = Services.aggregate_cube()
+    if aggregate_cube.initialized and aggregate_cube.supports_periods(periods):
+        income = [cents / 100 for cents in aggregate_cube.get_split_amounts(periods, aggregates.INCOME)]
+        expenses = [cents / 100 for cents in aggregate_cube.get_split_amounts(periods, aggregates.EXPENSES)]
+    else:
+        transactions = [get_transactions(date, date + date_delta) for date in date_list]
+
+        income = []
+        expenses = []
+        for transaction_list in transactions:
+            income_transactions = [t.amount for t in transaction_list if t.amount > 0 and not t.internal]
+            expenses_transactions = [t.amount for t in transaction_list if t.amount < 0 and not t.internal]
+            income.append(
+                sum(income_transactions))
+            expenses.append(
+                sum(expenses_transactions))
 
     profit = []
     loss = []
@@ -155,7 +201,23 @@ class Configuration:
 class Services(containers.DeclarativeContainer):
     logger.debug('Registering transaction mappers')
     config = providers.Factory(Configuration)
+    aggregate_cube = providers.Singleton(aggregates.TransactionAggregateCube)
+    import_jobs = providers.Singleton(import_jobs.ImportJobs)
     afas_mapper = providers.Singleton(afas.AfasTransactionCategoryMapper, config=config)
     cleanup_mapper = providers.Singleton(transaction_mapping.CategoryCleanupTransactionMapper)
-    internal_transactions_mapper = providers.Singleton(transaction_mapping.InternalTransactionsMapper)
+    internal_transactions_detector = providers.Singleton(transaction_mapping.MyInternalTransactionDetector)
+    internal_transactions_mapper = providers.Singleton(transaction_mapping.InternalTransactionsMapper,
+                                                       internal_transactions_detector=internal_transactions_detector)
     pattern_mapper = providers.Singleton(transaction_mapping.PatternTransactionCategoryMapper, config=config)
+    # Only the pattern mapper is memoized: the AFAS mapper depends on amount and date, and consumes its AFAS records
+    memoized_pattern_mapper = providers.Singleton(transaction_mapping.MemoizingTransactionCategoryMapper,
+                                                  mapper=pattern_mapper)
+    mapping_statistics = providers.Singleton(mapping_statistics.MappingStatistics)
+    # Learned from the categorized transactions, as a fallback for transactions that match no rule
+    classifier_mapper = providers.Singleton(classifier.TokenIndexTransactionCategoryMapper)
+    categorization_pipeline = providers.Singleton(transaction_mapping.CategorizationPipeline,
+                                                  mappers=providers.List(memoized_pattern_mapper, afas_mapper,
+                                                                         cleanup_mapper, internal_transactions_mapper,
+                                                                         classifier_mapper),
+                                                  internal_transactions_detector=internal_transactions_detector,
+                                                  statistics=mapping_statistics)
@@ -1,3 +1,4 @@
+import collections
 import csv
 import datetime
 import logging
@@ -66,35 +67,46 @@ class AfasTransaction:
         self.description = description
         self.counter_account = counter_account
         self.category = category
+        self.consumed = False
 
     def __repr__(self):
         return "€%.2f::%s::%s::%s" % (self.amount, self.date, self.name, self.description)
 
 
 class AfasExport:
-    """Contains exported data from AFAS. Can be used as a source for transaction categories."""
+    """Contains exported data from AFAS. Can be used as a source for transaction categories.
+
+    AFAS transactions are indexed by (amount, date) and by (amount, date2), each key holding a queue of the AFAS
+    transactions in the order in which they were added. Every AFAS transaction is used for one transaction only: it is
+    then marked as consumed, and dropped from the queues when it reaches their front."""
 
     def __init__(self):
-        self.transactions = []
+        self._index = {}
 
     def add_transaction(self, transaction):
-        self.transactions.append(transaction)
+        for date in {transaction.date, transaction.date2}:
+            self._index.setdefault((transaction.amount, date), collections.deque()).append(transaction)
 
     def get_category_for_analytics_transaction(self, transaction):
-        matches = [t for t in self.transactions if t.amount == transaction.amount
-                   and t.account in transaction.account.name
-                   and (t.date == transaction.date or t.date2 == transaction.date)
-                   and transaction.name in t.name
-                   and t.counter_account in transaction.counter_account]
-        if matches:
-            if len(matches) >= 1:
-                match = matches[0]
-                self.transactions.remove(match)
-                return match.category
-            else:
-                raise ValueError("Found zero matches for transaction %s" % str(transaction))
-        else:
-            pass
+        """Returns the category of the first (unconsumed) AFAS transaction that matches given transaction, and marks
+        that AFAS transaction as consumed. Returns None if there is no match."""
+        # Note that a Decimal and an equal float have the same hash, so amounts are looked up by numerical equality
+        key = (transaction.amount, transaction.date)
+        candidates = self._index.get(key)
+        if not candidates:
+            return None
+        while candidates and candidates[0].consumed:
+            candidates.popleft()
+        for candidate in candidates:
+            if not candidate.consumed \
+                    and candidate.account in transaction.account.name \
+                    and transaction.name in candidate.name \
+                    and candidate.counter_account in transaction.counter_account:
+                candidate.consumed = True
+                return candidate.category
+        if not candidates:
+            del self._index[key]
+        return None
 
 
 class AfasTransactionCategoryMapper(TransactionCategoryMapper):
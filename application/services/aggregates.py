@@ -0,0 +1,109 @@
+import decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+INCOME = 0
+EXPENSES = 1
+INTERNAL = 2
+
+
+def to_cents(amount):
+    """Converts given amount (Decimal, float, int or string) to an integer number of cents."""
+    return int(decimal.Decimal(str(amount)).scaleb(2).to_integral_value(rounding=decimal.ROUND_HALF_UP))
+
+
+def _month_key(date):
+    return date.year * 12 + date.month - 1
+
+
+class TransactionAggregateCube:
+    """Materialized totals of transaction amounts (in cents) per account, category and month, split into income,
+    expenses and internal transfers. The cube is built once from the repository and then kept up to date with the
+    domain events that create or change transactions, so that series of (sub)category totals can be computed in time
+    proportional to the number of periods instead of the number of transactions.
+
+    The events are handled while the repository batch that publishes them holds the lock of the account repository.
+    Readers in other threads must hold that lock as well (see AccountRepository.lock)."""
+
+    def __init__(self):
+        self._cells = {}
+        self._contributions = {}
+        self.initialized = False
+
+    def rebuild(self, accounts):
+        """Recomputes the cube from all transactions of given accounts."""
+        self._cells.clear()
+        self._contributions.clear()
+        for account in accounts:
+            for transaction in account.get_transactions():
+                self._add(transaction)
+        self.initialized = True
+        logger.info("Aggregated %d transactions into %d account/category cells", len(self._contributions),
+                    len(self._cells))
+
+    def on_transaction_event(self, event):
+        """Handles TransactionCreatedEvent, TransactionCategorizedEvent and TransactionSetInternalEvent events, by
+        moving the amount of the transaction to the cell that matches its current state."""
+        self.update_transaction(event.transaction)
+
+    def update_transaction(self, transaction):
+        """Updates the cube with the current state of given (new or changed) transaction."""
+        self._remove(transaction.id)
+        self._add(transaction)
+
+    @staticmethod
+    def supports_periods(periods):
+        """Returns True if all given (start_date, end_date) periods consist of whole months."""
+        return all(start.day == 1 and end.day == 1 for start, end in periods)
+
+    def get_category_amounts(self, category, periods):
+        """Returns the list of summed amounts (in cents) of transactions of given category and its subcategories, for
+        each of given month-aligned (start_date, end_date) periods. If category is None, the amounts of
+        uncategorized transactions are returned."""
+        def matches(cell_category):
+            if category is None:
+                return cell_category is None
+            return cell_category == category or (cell_category and cell_category.inherits_from(category))
+
+        return self._sum(periods, matches, (INCOME, EXPENSES, INTERNAL))
+
+    def get_split_amounts(self, periods, split):
+        """Returns the list of summed amounts (in cents) of all transactions in given split (INCOME, EXPENSES or
+        INTERNAL), for each of given month-aligned (start_date, end_date) periods."""
+        return self._sum(periods, lambda cell_category: True, (split,))
+
+    def _sum(self, periods, category_filter, splits):
+        periods_of_month = {}
+        for index, (start, end) in enumerate(periods):
+            for month in range(_month_key(start), _month_key(end)):
+                periods_of_month.setdefault(month, []).append(index)
+
+        sums = [0] * len(periods)
+        for (_, cell_category), months in self._cells.items():
+            if not category_filter(cell_category):
+                continue
+            for month, totals in months.items():
+                for index in periods_of_month.get(month, ()):
+                    sums[index] += sum(totals[split] for split in splits)
+        return sums
+
+    def _add(self, transaction):
+        cents = to_cents(transaction.amount)
+        if transaction.internal:
+            split = INTERNAL
+        elif cents > 0:
+            split = INCOME
+        else:
+            split = EXPENSES
+        cell = (transaction.account.id, transaction.category)
+        month = _month_key(transaction.date)
+        totals = self._cells.setdefault(cell, {}).setdefault(month, [0, 0, 0])
+        totals[split] += cents
+        self._contributions[transaction.id] = (cell, month, split, cents)
+
+    def _remove(self, transaction_id):
+        contribution = self._contributions.pop(transaction_id, None)
+        if contribution:
+            cell, month, split, cents = contribution
+            self._cells[cell][month][split] -= cents
@@ -0,0 +1,170 @@
+"""Column-oriented binary format of native dumps.
+
+A dump consists of the magic bytes, the length of a JSON header (uint32, little endian), the JSON header and the
+column data. The header holds the accounts and categories, the number of transactions, the dictionaries of
+dictionary-encoded columns and the type, offset and length of every column. Columns are stored as arrays of fixed-size
+integers (8-byte aligned, in the byte order given by the header), so they can be used directly from a memory map:
+
+- 'int' columns hold integers (array typecode given by the header), e.g. dates as ordinal day numbers and amounts as
+  cents. Missing values are stored as the 'null' value given by the header (if any).
+- 'uuid' columns hold 32 character hexadecimal ids as 16 bytes each.
+- 'dict' columns hold int32 indexes into the dictionary of the column in the header (-1 for missing values).
+- 'str' columns hold n + 1 uint64 offsets into the utf-8 encoded data that directly follows the offsets.
+"""
+import array
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b"FMDUMP\x00\x01"
+ALIGNMENT = 8
+NULL_CODE = -1
+
+
+class BinaryDumpWriter:
+    """Writes columns to a binary dump. Columns are collected in memory and written when the writer is closed."""
+
+    def __init__(self, filename, accounts, categories):
+        self.filename = filename
+        self.header = {"byteorder": sys.byteorder, "accounts": accounts, "categories": categories, "count": None,
+                       "columns": []}
+        self._data = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def add_int_column(self, name, values, typecode="q", null=None):
+        values = array.array(typecode, (null if value is None else value for value in values))
+        self._add_column({"name": name, "type": "int", "typecode": typecode, "null": null}, len(values),
+                         values.tobytes())
+
+    def add_uuid_column(self, name, values):
+        data = b"".join(bytes.fromhex(value) for value in values)
+        self._add_column({"name": name, "type": "uuid"}, len(data) // 16, data)
+
+    def add_dict_column(self, name, values):
+        dictionary = {}
+        codes = array.array("i", (NULL_CODE if value is None else dictionary.setdefault(value, len(dictionary))
+                                  for value in values))
+        self._add_column({"name": name, "type": "dict", "dictionary": list(dictionary)}, len(codes),
+                         codes.tobytes())
+
+    def add_str_column(self, name, values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = array.array("Q", [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        self._add_column({"name": name, "type": "str"}, len(encoded), offsets.tobytes() + b"".join(encoded))
+
+    def _add_column(self, column, count, data):
+        if self.header["count"] is None:
+            self.header["count"] = count
+        elif count != self.header["count"]:
+            raise ValueError("Column %s has %d values instead of %d" % (column["name"], count, self.header["count"]))
+        self.header["columns"].append(column)
+        self._data.append(data)
+
+    def close(self):
+        # Offsets are relative to the (aligned) start of the column data, so they do not depend on the header size
+        offset = 0
+        for column, data in zip(self.header["columns"], self._data):
+            column["offset"], column["length"] = offset, len(data)
+            offset += _align(len(data))
+        header = json.dumps(self.header).encode("utf-8")
+        with open(self.filename, "wb") as dump:
+            dump.write(MAGIC)
+            dump.write(struct.pack("<I", len(header)))
+            dump.write(header)
+            dump.write(b"\x00" * (_align(dump.tell()) - dump.tell()))
+            for data in self._data:
+                dump.write(data)
+                dump.write(b"\x00" * (_align(len(data)) - len(data)))
+
+
+class BinaryDumpReader:
+    """Reads the columns of a binary dump from a memory map. Columns are returned as memoryviews (or as lists for 'str'
+    and 'uuid' columns), which are only valid while the reader is open."""
+
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        magic = self._file.read(len(MAGIC))
+        if magic != MAGIC:
+            self._file.close()
+            raise ValueError("%s is not a binary dump" % filename)
+        header_length, = struct.unpack("<I", self._file.read(4))
+        self.header = json.loads(self._file.read(header_length).decode("utf-8"))
+        self._data_offset = _align(len(MAGIC) + 4 + header_length)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        self._columns = {column["name"]: column for column in self.header["columns"]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def accounts(self):
+        return self.header["accounts"]
+
+    @property
+    def categories(self):
+        return self.header["categories"]
+
+    def __len__(self):
+        return self.header["count"] or 0
+
+    def get_dictionary(self, name):
+        return self._columns[name]["dictionary"]
+
+    def get_null(self, name):
+        return self._columns[name]["null"]
+
+    def get_column(self, name):
+        """Returns the values of given 'int' column, or the dictionary indexes of given 'dict' column."""
+        column = self._columns[name]
+        typecode = column["type"] == "dict" and "i" or column["typecode"]
+        data = self._view(column["offset"], column["length"])
+        if self.header["byteorder"] != sys.byteorder:
+            values = array.array(typecode)
+            values.frombytes(data)
+            values.byteswap()
+            return values
+        view = data.cast(typecode)
+        self._views.append(view)
+        return view
+
+    def get_strings(self, name):
+        column = self._columns[name]
+        if column["type"] == "uuid":
+            data = self._view(column["offset"], column["length"])
+            return [data[i:i + 16].hex() for i in range(0, column["length"], 16)]
+        offsets = array.array("Q")
+        offsets.frombytes(self._view(column["offset"], (len(self) + 1) * 8))
+        if self.header["byteorder"] != sys.byteorder:
+            offsets.byteswap()
+        data = self._view(column["offset"] + len(offsets) * 8, offsets[-1])
+        return [str(data[offsets[i]:offsets[i + 1]], "utf-8") for i in range(len(self))]
+
+    def _view(self, offset, length):
+        start = self._data_offset + offset
+        view = memoryview(self._map)[start:start + length]
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
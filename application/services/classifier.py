@@ -0,0 +1,184 @@
+import collections
+import logging
+import math
+import re
+import time
+
+from domain.account_management.model.account import account_repository
+from domain.account_management.services import TransactionCategoryMapper
+
+logger = logging.getLogger(__name__)
+
+# Words of at least two letters; numbers (dates, terminal ids, amounts) mostly differ between similar transactions
+WORD_PATTERN = re.compile(r"[^\W\d_]{2,}")
+
+
+def get_tokens(transaction):
+    """Returns the set of tokens of given transaction: the words of its (lowercase) name and description, prefixed by
+    the field they occur in, and its counter account."""
+    tokens = {"n:" + word for word in WORD_PATTERN.findall(transaction.name.lower())}
+    tokens.update("d:" + word for word in WORD_PATTERN.findall(transaction.description.lower()))
+    if transaction.counter_account:
+        tokens.add("c:" + transaction.counter_account)
+    return frozenset(tokens)
+
+
+class TokenIndexTransactionCategoryMapper(TransactionCategoryMapper):
+    """Classifies uncategorized transactions by the categories of their nearest neighbours among the categorized
+    transactions, i.e. the transactions of which the tokens (see get_tokens) have the highest cosine similarity,
+    weighing every token by its inverse document frequency. Intended as the last mapper of a pipeline, as a fallback
+    for transactions that match no rule.
+
+    Transactions with the same tokens are deduplicated into one signature that counts their categories. An inverted
+    index maps every token to the signatures that contain it. Only the postings of tokens that occur in at most
+    max_postings signatures are traversed to find candidate neighbours, so frequent (stopword-like) tokens do not
+    slow down classification, while they still count in the similarity of the candidates.
+
+    The index is built from the repository when the first transaction is classified, and is kept up to date with
+    TransactionCategorizedEvents (see on_transaction_categorized_event), except for the categories that were
+    predicted by this mapper itself."""
+
+    def __init__(self, neighbours=5, min_similarity=0.5, max_postings=1000, max_predictions=10000):
+        self.neighbours = neighbours
+        self.min_similarity = min_similarity
+        self.max_postings = max_postings
+        self.max_predictions = max_predictions
+        self._trained = False
+        self._clear()
+
+    def _clear(self):
+        self._signature_ids = {}
+        self._signatures = []
+        self._category_counts = []
+        self._postings = collections.defaultdict(set)
+        self._learned = {}
+        self._predictions = collections.OrderedDict()
+        self._norms = {}
+        self._norms_size = 0
+
+    def train(self, transactions):
+        """(Re)builds the index from the categorized transactions of given transactions."""
+        start = time.time()
+        self._clear()
+        for transaction in transactions:
+            if transaction.category:
+                self._learn(transaction, transaction.category)
+        self._trained = True
+        logger.info("Trained classifier with %d transactions (%d signatures, %d tokens) in %.2f seconds",
+                    len(self._learned), len(self._signatures), len(self._postings), time.time() - start)
+
+    def _train_from_repository(self):
+        self.train(transaction for account in account_repository().get_accounts()
+                   for transaction in account.get_transactions())
+
+    def on_transaction_categorized_event(self, event):
+        """Learns the new category of the transaction, unless it was predicted by this mapper."""
+        if not self._trained:
+            return
+        predicted = self._predictions.pop(event.transaction.id, None)
+        self._forget(event.transaction)
+        if event.new_category and event.new_category is not predicted:
+            self._learn(event.transaction, event.new_category)
+
+    def _learn(self, transaction, category):
+        tokens = get_tokens(transaction)
+        signature_id = self._signature_ids.get(tokens)
+        if signature_id is None:
+            signature_id = len(self._signatures)
+            self._signature_ids[tokens] = signature_id
+            self._signatures.append(tokens)
+            self._category_counts.append(collections.Counter())
+        if not self._category_counts[signature_id]:
+            for token in tokens:
+                self._postings[token].add(signature_id)
+        self._category_counts[signature_id][category] += 1
+        self._learned[transaction.id] = (signature_id, category)
+
+    def _forget(self, transaction):
+        signature_id, category = self._learned.pop(transaction.id, (None, None))
+        if signature_id is None:
+            return
+        counts = self._category_counts[signature_id]
+        counts[category] -= 1
+        if counts[category] <= 0:
+            del counts[category]
+        if not counts:
+            for token in self._signatures[signature_id]:
+                self._postings[token].discard(signature_id)
+                if not self._postings[token]:
+                    del self._postings[token]
+            self._norms.pop(signature_id, None)
+
+    def _idf(self, token, size):
+        # Smoothed, so that unknown tokens (which lower the similarity of every candidate) have a finite weight
+        postings = self._postings.get(token)
+        return math.log((1 + size) / (1 + (postings and len(postings) or 0))) + 1
+
+    def _norm(self, signature_id, size):
+        norm = self._norms.get(signature_id)
+        if norm is None:
+            norm = math.sqrt(sum(self._idf(token, size) ** 2 for token in self._signatures[signature_id]))
+            self._norms[signature_id] = norm
+        return norm
+
+    def get_category_scores(self, transaction):
+        """Returns the categories of the nearest neighbours of given transaction, scored by the sum of their
+        similarities (between 0 and 1, weighed by the share of the category in the neighbour). Returns no scores for
+        transactions that already have a category."""
+        if transaction.category:
+            return []
+        if not self._trained:
+            self._train_from_repository()
+
+        size = len(self._signature_ids)
+        # The norms of the signatures depend on the idf weights, which change as the index grows
+        if size > self._norms_size * 1.1:
+            self._norms.clear()
+            self._norms_size = size
+        weights = {token: self._idf(token, size) ** 2 for token in get_tokens(transaction)}
+        known = sorted((token for token in weights if token in self._postings), key=lambda t: len(self._postings[t]))
+        if not known:
+            return []
+        # The dot products of the candidates are accumulated from the traversed postings, frequent tokens are added by
+        # looking up the candidates in their postings
+        dots = collections.Counter()
+        traversed = 0
+        for token in known:
+            postings = self._postings[token]
+            if len(postings) > self.max_postings:
+                break
+            weight = weights[token]
+            for signature_id in postings:
+                dots[signature_id] += weight
+            traversed += 1
+        if not traversed:
+            # Only frequent tokens: the neighbours must share all of them
+            dots = dict.fromkeys(set.intersection(*[self._postings[token] for token in known]), 0.0)
+        for token in known[traversed:]:
+            postings, weight = self._postings[token], weights[token]
+            for signature_id in dots:
+                if signature_id in postings:
+                    dots[signature_id] += weight
+
+        query_norm = math.sqrt(sum(weights.values()))
+        similarities = []
+        for signature_id, dot in dots.items():
+            similarity = dot / (query_norm * self._norm(signature_id, size))
+            if similarity >= self.min_similarity:
+                similarities.append((similarity, signature_id))
+
+        scores = collections.Counter()
+        for similarity, signature_id in sorted(similarities, reverse=True)[:self.neighbours]:
+            counts = self._category_counts[signature_id]
+            total = sum(counts.values())
+            for category, count in counts.items():
+                scores[category] += similarity * count / total
+        if scores:
+            self._remember_prediction(transaction, scores.most_common(1)[0][0])
+        return [TransactionCategoryMapper.CategoryScore(category, score) for category, score in scores.most_common()]
+
+    def _remember_prediction(self, transaction, category):
+        self._predictions[transaction.id] = category
+        self._predictions.move_to_end(transaction.id)
+        while len(self._predictions) > self.max_predictions:
+            self._predictions.popitem(last=False)
@@ -0,0 +1,42 @@
+import contextlib
+import gzip
+import io
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# The default of the gzip command, which compresses several times faster than the maximum level of the gzip module
+GZIP_LEVEL = 6
+
+
+def is_available(compression):
+    """Returns True if given compression ('gzip' or 'zstd') can be used (zstd requires the zstandard package)."""
+    return compression == "gzip" or compression == "zstd" and zstandard is not None
+
+
+@contextlib.contextmanager
+def open_text_file(filename, mode="r"):
+    """Opens given file as text for reading ('r') or writing ('w'), (de)compressing it with gzip or zstd if its name
+    ends with .gz or .zst. Filename '-' denotes stdin or stdout."""
+    if filename == "-":
+        yield mode == "r" and sys.stdin or sys.stdout
+    elif filename.endswith(SUFFIXES["gzip"]):
+        with gzip.open(filename, mode + "t", compresslevel=GZIP_LEVEL, newline="") as text:
+            yield text
+    elif filename.endswith(SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise ValueError("Install the zstandard package to read or write %s" % filename)
+        with open(filename, mode + "b") as raw:
+            if mode == "r":
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            with io.TextIOWrapper(stream, newline="") as text:
+                yield text
+    else:
+        with open(filename, mode, newline="") as text:
+            yield text
@@ -1,37 +1,62 @@
 import csv
-
-
-def _account_to_dict(account):
-    return {"account_id": account.id, "name": account.name, "bank": account.bank}
-
-
-def _transaction_to_dict(transaction):
-    return {"transaction_id": transaction.id, "amount": transaction.amount, "date": transaction.date,
-            "name": transaction.name, "description": transaction.description,
-            "balance_after": transaction.balance_after, "serial": transaction.serial,
-            "counter_account": transaction.counter_account, "account": transaction.account.id,
-            "category": transaction.category and transaction.category.qualified_name or None}
-
-
-def export_accounts(account_list, account_filename, transaction_filename):
-    with open(account_filename, 'w') as account_csv_file, open(transaction_filename, 'w') as transaction_csv_file:
-        account_fieldnames = ["account_id", "name", "bank"]
-        account_writer = csv.DictWriter(account_csv_file, fieldnames=account_fieldnames)
-        account_writer.writeheader()
-        transaction_fieldnames = ["transaction_id", "amount", "date", "name", "description", "balance_after", "serial",
-                                  "counter_account", "account", "category"]
-        transaction_writer = csv.DictWriter(transaction_csv_file, fieldnames=transaction_fieldnames)
-        transaction_writer.writeheader()
-        for account in account_list:
-            account_writer.writerow(_account_to_dict(account))
-            for transaction in account.get_transactions():
-                transaction_writer.writerow(_transaction_to_dict(transaction))
-
-
-def export_categories(category_list, category_filename):
-    with open(category_filename, 'w') as csv_file:
-        category_fieldnames = ["category_id", "qualified_name"]
-        category_writer = csv.DictWriter(csv_file, fieldnames=category_fieldnames)
-        category_writer.writeheader()
-        for category in category_list:
-            category_writer.writerow({"category_id": category.id, "qualified_name": category.qualified_name})
+import datetime
+import decimal
+import functools
+import re
+
+from application.services import binary_dump, compression
+
+SERIAL_NULL = -2 ** 63
+UUID_PATTERN = re.compile("^[0-9a-f]{32}$")
+
+
+def export_rows(fieldnames, rows, filename):
+    """Writes given column names and rows (tuples) to given native csv-file, which is compressed if its name ends with
+    .gz or .zst, or written to stdout if it is '-' (see compression.open_text_file)."""
+    with compression.open_text_file(filename, "w") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(fieldnames)
+        writer.writerows(rows)
+
+
+def export_binary(accounts, categories, transactions, filename):
+    """Writes given accounts and categories (dicts with the columns of the native csv-files) and transactions (tuples in
+    the column order of the native transactions.csv) to given binary dump (see binary_dump). Dates are stored as
+    ordinal day numbers and amounts as cents."""
+    transaction_ids, amounts, dates, names, descriptions, balances, serials, counter_accounts, account_ids, internals, \
+        category_names = list(zip(*transactions)) or [()] * 11
+    with binary_dump.BinaryDumpWriter(filename, accounts, categories) as dump:
+        if all(UUID_PATTERN.match(transaction_id) for transaction_id in transaction_ids):
+            dump.add_uuid_column("transaction_id", transaction_ids)
+        else:
+            dump.add_str_column("transaction_id", transaction_ids)
+        dump.add_dict_column("account", account_ids)
+        dump.add_int_column("serial", serials, null=SERIAL_NULL)
+        dump.add_int_column("date", (_to_ordinal(date) for date in dates), typecode="i")
+        dump.add_int_column("amount", (_to_cents(amount) for amount in amounts))
+        dump.add_dict_column("name", names)
+        dump.add_str_column("description", descriptions)
+        dump.add_dict_column("counter_account", counter_accounts)
+        dump.add_int_column("balance_after", (_to_cents(balance) for balance in balances))
+        dump.add_int_column("internal", (internal and 1 or 0 for internal in internals), typecode="b")
+        dump.add_dict_column("category", category_names)
+
+
+@functools.lru_cache(maxsize=None)
+def _to_ordinal(date):
+    """Returns the ordinal day number of given date (or ISO formatted date string)."""
+    if isinstance(date, str):
+        date = datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+    return date.toordinal()
+
+
+def _to_cents(amount):
+    if isinstance(amount, float):
+        # Fast path for amounts read from the database: whole cents survive the round trip through float division
+        cents = round(amount * 100)
+        if cents / 100 == amount:
+            return cents
+    cents = decimal.Decimal(str(amount)).scaleb(2)
+    if cents != cents.to_integral_value():
+        raise ValueError("Amount %s can not be stored as a whole number of cents" % amount)
+    return int(cents)
@@ -1,36 +1,53 @@
 import csv
-import itertools
+import decimal
+import functools
 import logging
 import datetime
 
-from domain.account_management.model.account import account_repository, account_factory
-from domain.account_management.model.category import category_repository, category_factory
+from application.services import binary_dump, compression
+from application.services.transaction_mapping import MyInternalTransactionDetector
+from domain.account_management.model.account import account_repository, account_factory, Transaction
+from domain.account_management.model.category import category_repository, category_factory, Category
 
 logger = logging.getLogger(__name__)
 
 
 def import_categories(filename):
-    with open(filename) as csv_file:
-        reader = csv.DictReader(csv_file)
-        for row in reader:
+    with compression.open_text_file(filename) as csv_file:
+        import_category_rows(list(csv.DictReader(csv_file)))
+
+
+def import_category_rows(rows):
+    """Imports given category rows (dicts with a category_id and qualified_name), keeping their ids. Parents are
+    imported before their children, so that every parent keeps its id as well."""
+    with category_repository().batch():
+        for row in sorted(rows, key=lambda r: r["qualified_name"].count("::")):
             category_id, qualified_name = row["category_id"], row["qualified_name"]
             category = category_repository().get_category_by_qualified_name(qualified_name)
             if not category:
-                category = category_factory().create_category_from_qualified_name(qualified_name)
-                category.id = category_id
+                parent_name, _, name = qualified_name.rpartition("::")
+                parent = parent_name and _get_or_create_category(parent_name) or None
+                category = Category(category_id, name, parent)
+                if parent:
+                    parent.children.append(category)
                 category_repository().save_category(category)
             else:
                 logger.info("Skipping import of existing category %s", category)
 
 
 def import_accounts(filename):
+    with compression.open_text_file(filename) as csv_file:
+        import_account_rows(csv.DictReader(csv_file))
+
+
+def import_account_rows(rows):
+    """Imports given account rows (dicts with an account_id, name and bank), keeping their ids."""
     if account_repository().get_accounts():
         logger.error("Native import of accounts is only allowed on an empty database!")
         return
 
-    with open(filename) as csv_file:
-        reader = csv.DictReader(csv_file)
-        for row in reader:
+    with account_repository().batch():
+        for row in rows:
             account_id, name, bank = row["account_id"], row["name"], row["bank"]
             account = account_repository().get_account(account_id)
             if not account:
@@ -41,34 +58,87 @@ def import_accounts(filename):
                 logger.info("Skipping import of existing account %s", account)
 
 
-def import_transactions(filename):
-    if list(itertools.chain.from_iterable([a.get_transactions() for a in account_repository().get_accounts()])):
+def restore_transactions(filename):
+    """Restores the transactions of a native export, keeping their ids, categories and internal flags. Transactions
+    are not categorized again: they are inserted in bulk without publishing domain events. Exports without an
+    'internal' column are flagged by the internal transaction detector."""
+    if any(a.get_transactions() for a in account_repository().get_accounts()):
         logger.error("Native import of transactions is only allowed on an empty transactions table!")
         return
 
-    with open(filename) as csv_file:
+    with compression.open_text_file(filename) as csv_file:
         reader = csv.DictReader(csv_file)
-        for row in reader:
-            transaction_id = row["transaction_id"]
-            amount = row["amount"]
-            date = datetime.datetime.strptime(row["date"], '%Y-%m-%d').date()
-            name = row["name"]
-            description = row["description"]
-            balance_after = row["balance_after"]
-            serial = row["serial"]
-            counter_account = row["counter_account"]
-            account_id = row["account"]
-            category_qualified_name = row["category"]
-            transaction = account_repository().get_transaction(transaction_id)
-            account = account_repository().get_account(account_id)
-            if not transaction:
-                transaction = account_factory().create_transaction(account, date, amount, name, description, serial,
-                                                                   counter_account, balance_after)
-                transaction.id = transaction_id
-                if category_qualified_name:
-                    category = category_repository().get_category_by_qualified_name(category_qualified_name)
-                    if not category:
-                        category = category_factory().create_category_from_qualified_name(category_qualified_name)
-                        category_repository().save_category(category)
-                    transaction.update_category(category)
-            account_repository().save_transaction(transaction)
+        internal_transactions_detector = None if "internal" in reader.fieldnames else MyInternalTransactionDetector()
+        account_repository().insert_transactions(
+            _row_to_transaction(row, internal_transactions_detector) for row in reader)
+
+
+def restore_binary(filename):
+    """Restores the accounts, categories and transactions of a binary dump (see binary_dump), like
+    restore_transactions does for native csv-files. The columns are read from a memory map."""
+    with binary_dump.BinaryDumpReader(filename) as dump:
+        import_category_rows(dump.categories)
+        import_account_rows(dump.accounts)
+        if any(a.get_transactions() for a in account_repository().get_accounts()):
+            logger.error("Native import of transactions is only allowed on an empty transactions table!")
+            return
+
+        accounts = [account_repository().get_account(account_id) for account_id in dump.get_dictionary("account")]
+        categories = [_get_or_create_category(qualified_name) for qualified_name in dump.get_dictionary("category")]
+        dates = {}
+        names, counter_accounts = dump.get_dictionary("name"), dump.get_dictionary("counter_account")
+        serial_null = dump.get_null("serial")
+
+        def create_transactions(ids, account_codes, serials, date_ordinals, amounts, name_codes, descriptions,
+                                counter_account_codes, balances, internals, category_codes):
+            for i in range(len(ids)):
+                date = dates.get(date_ordinals[i])
+                if not date:
+                    date = dates.setdefault(date_ordinals[i], datetime.date.fromordinal(date_ordinals[i]))
+                yield Transaction(ids[i], accounts[account_codes[i]], None if serials[i] == serial_null else serials[i],
+                                  date, decimal.Decimal(amounts[i]).scaleb(-2), names[name_codes[i]], descriptions[i],
+                                  _get_code(counter_accounts, counter_account_codes[i]),
+                                  decimal.Decimal(balances[i]).scaleb(-2), bool(internals[i]),
+                                  _get_code(categories, category_codes[i]))
+
+        account_repository().insert_transactions(create_transactions(
+            dump.get_strings("transaction_id"), dump.get_column("account"), dump.get_column("serial"),
+            dump.get_column("date"), dump.get_column("amount"), dump.get_column("name"),
+            dump.get_strings("description"), dump.get_column("counter_account"), dump.get_column("balance_after"),
+            dump.get_column("internal"), dump.get_column("category")))
+
+
+def _get_code(dictionary, code):
+    """Returns the value of given code of a dictionary-encoded column (None for NULL_CODE)."""
+    return None if code == binary_dump.NULL_CODE else dictionary[code]
+
+
+def _row_to_transaction(row, internal_transactions_detector):
+    account = account_repository().get_account(row["account"])
+    if not account:
+        raise ValueError("Transaction %s refers to unknown account %s" % (row["transaction_id"], row["account"]))
+    category = row["category"] and _get_or_create_category(row["category"]) or None
+    transaction = Transaction(row["transaction_id"], account, int(row["serial"]) if row["serial"] else None,
+                              _parse_date(row["date"]), decimal.Decimal(row["amount"]), row["name"],
+                              row["description"], row["counter_account"], decimal.Decimal(row["balance_after"]),
+                              category=category)
+    if internal_transactions_detector:
+        transaction.internal = internal_transactions_detector.is_internal_transaction(transaction)
+    else:
+        transaction.internal = row["internal"] in ("True", "1")
+    return transaction
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_date(date_string):
+    """Returns the date of given ISO formatted string, ignoring a time part (if any). Dates are memoized, since many
+    transactions share a date."""
+    return datetime.datetime.strptime(date_string[:10], '%Y-%m-%d').date()
+
+
+def _get_or_create_category(qualified_name):
+    category = category_repository().get_category_by_qualified_name(qualified_name)
+    if not category:
+        category = category_factory().create_category_from_qualified_name(qualified_name)
+        category_repository().save_category(category)
+    return category
@@ -1,30 +1,105 @@
+import collections
+import concurrent.futures
 import csv
 import datetime
 import decimal
+import itertools
 import logging
 import io
 
 from domain.account_management import services
 from domain.account_management.model.account import account_repository, account_factory
 
+RabobankRecord = collections.namedtuple("RabobankRecord", ["account", "serial", "date", "amount", "name", "description",
+                                                           "counter_account", "balance"])
 
-def import_transactions_from_rabobank_csv(filename, bank):
+
+def import_transactions_from_rabobank_csv(filename, bank, categorization_pipeline):
     """Parses given csv-file export from given bank into the database (resulting in accounts and transactions).
     """
     logger.info("Importing %s", filename)
     with open(filename, encoding="ISO-8859-1") as csv_text:
-        import_transactions_from_rabobank_text(csv_text, bank)
+        import_transactions_from_rabobank_text(csv_text, bank, categorization_pipeline)
+
+
+class ImportStatistics:
+    """Counts the progress of an import: the rows that were parsed, and of the parsed rows the number of transactions
+    that were inserted, skipped as duplicates and categorized (by the transaction mappers)."""
+
+    def __init__(self):
+        self.rows_parsed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.categorized = 0
+
+    def add(self, other):
+        self.rows_parsed += other.rows_parsed
+        self.inserted += other.inserted
+        self.duplicates += other.duplicates
+        self.categorized += other.categorized
+
+    def __repr__(self):
+        return "{c}(rows_parsed={rows_parsed}, inserted={inserted}, duplicates={duplicates}, " \
+               "categorized={categorized})".format(c=self.__class__.__name__, **self.__dict__)
 
 
-def import_transactions_from_rabobank_text(csv_text, bank):
+def import_transactions_from_rabobank_csv_files(filename_list, bank, categorization_pipeline, processes=None):
+    """Parses given csv-file exports from given bank into the database. The files are parsed in parallel by a pool of
+    processes, after which all records are written in serial order by this process (see import_rabobank_records).
+    Returns the ImportStatistics."""
+    high_water_marks = _get_high_water_marks(bank)
+    if len(filename_list) > 1 and processes != 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            parsed_files = list(executor.map(parse_rabobank_csv, filename_list,
+                                             itertools.repeat(high_water_marks)))
+    else:
+        parsed_files = [parse_rabobank_csv(filename, high_water_marks) for filename in filename_list]
+
+    statistics = ImportStatistics()
+    records = []
+    for filename, (file_records, file_statistics) in zip(filename_list, parsed_files):
+        logger.info("Parsed %d rows from %s (skipped %d rows that were already imported)",
+                    file_statistics.rows_parsed, filename, file_statistics.duplicates)
+        statistics.add(file_statistics)
+        records.extend(file_records)
+    records.sort(key=lambda r: (r.account, r.serial))
+    import_rabobank_records(records, bank, statistics, categorization_pipeline)
+    logger.info("Imported %s", statistics)
+    return statistics
+
+
+def import_transactions_from_rabobank_text(csv_text, bank, categorization_pipeline, statistics=None):
+    """Parses given csv text (a file-like object) into the database. Rows are parsed and saved incrementally (see
+    import_rabobank_records), while updating given ImportStatistics (if any). Returns the ImportStatistics."""
     logger.info("Parsing csv: '%s'", dir(csv_text))
+    statistics = statistics or ImportStatistics()
     reader = csv.DictReader(csv_text, delimiter=',', doublequote=True)
     logger.info("Fieldnames: %s", reader.fieldnames)
-    for row in reader:
-        logger.debug("parsing row: %s", row)
-        account_id = row["IBAN/BBAN"]
-        account = _get_or_create_account(account_id, bank)
+    import_rabobank_records(parse_rabobank_rows(reader, _get_high_water_marks(bank), statistics), bank, statistics,
+                            categorization_pipeline)
+    logger.info("Imported %s", statistics)
+    return statistics
+
+
+def parse_rabobank_csv(filename, high_water_marks):
+    """Parses given Rabobank csv-file into a list of RabobankRecords. Returns the list of records and the
+    ImportStatistics of the parsed rows. Does not access any repository, so it can run in another process."""
+    statistics = ImportStatistics()
+    with open(filename, encoding="ISO-8859-1") as csv_text:
+        reader = csv.DictReader(csv_text, delimiter=',', doublequote=True)
+        return list(parse_rabobank_rows(reader, high_water_marks, statistics)), statistics
+
+
+def parse_rabobank_rows(rows, high_water_marks, statistics):
+    """Parses given Rabobank csv rows (dicts) into RabobankRecords, skipping (and counting as duplicates in given
+    ImportStatistics) the rows that are below the high-water mark of their account (see _get_high_water_mark)."""
+    for row in rows:
+        statistics.rows_parsed += 1
+        if _is_below_high_water_mark(row, high_water_marks.get(row["IBAN/BBAN"])):
+            statistics.duplicates += 1
+            continue
 
+        logger.debug("parsing row: %s", row)
         date = datetime.datetime.strptime(row["Rentedatum"], "%Y-%m-%d").date()
         amount = decimal.Decimal(row["Bedrag"].replace(",", "."))
         name = " ".join(row["Naam tegenpartij"].split())
@@ -35,29 +110,89 @@ def import_transactions_from_rabobank_text(csv_text, bank):
         serial = int(row["Volgnr"].lstrip("0"))
         counter_account = row["Tegenrekening IBAN/BBAN"]
         balance = decimal.Decimal(row["Saldo na trn"].replace(",", "."))
+        yield RabobankRecord(row["IBAN/BBAN"], serial, date, amount, name, description, counter_account, balance)
+
+
+def import_rabobank_records(records, bank, statistics, categorization_pipeline, batch_size=5000):
+    """Creates a transaction for each of given RabobankRecords, unless an identical transaction already exists (in the
+    database, or earlier in the records). Transactions are saved in batches of given size, while updating given
+    ImportStatistics. The new transactions of every batch are categorized by given CategorizationPipeline before the
+    batch is written, so every transaction is written once."""
+    transaction_index = services.TransactionIndex()
+    accounts = {}
+    records = iter(records)
+    batch = list(itertools.islice(records, batch_size))
+    while batch:
+        new_transactions = []
+        with account_repository().batch():
+            for record in batch:
+                account = accounts.get(record.account)
+                if not account:
+                    account = _get_or_create_account(record.account, bank)
+                    accounts[record.account] = account
 
-        # Only create a new transaction if no identical transaction already exists!
-        existing_transactions = services.find_transactions_by_attributes(account, date, serial, amount,
-                                                                         name, counter_account,
-                                                                         description)
-        if existing_transactions:
-            if len(existing_transactions) > 1:
-                raise ValueError("Database contains duplicate transactions!")
-            else:
-                logger.info("Skipping duplicate transaction: %s", existing_transactions[0])
-        else:
-            transaction = account_factory().create_transaction(account, date, amount, name, description, serial,
-                                                               counter_account, balance)
-            logger.info("Adding new transaction: %s", transaction)
-            account_repository().save_transaction(transaction)
-            account.add_transaction(transaction)
-
-        # mapping.map_transaction(transaction)
+                # Only create a new transaction if no identical transaction already exists!
+                existing_transactions = transaction_index.find(account, record.date, record.serial, record.amount,
+                                                               record.name, record.counter_account,
+                                                               record.description)
+                if existing_transactions:
+                    if len(existing_transactions) > 1:
+                        raise ValueError("Database contains duplicate transactions!")
+                    else:
+                        logger.info("Skipping duplicate transaction: %s", existing_transactions[0])
+                        statistics.duplicates += 1
+                else:
+                    transaction = account_factory().create_transaction(account, record.date, record.amount,
+                                                                       record.name, record.description, record.serial,
+                                                                       record.counter_account, record.balance)
+                    logger.info("Adding new transaction: %s", transaction)
+                    account_repository().save_transaction(transaction)
+                    account.add_transaction(transaction)
+                    transaction_index.add(transaction)
+                    new_transactions.append(transaction)
+            categorization_pipeline.categorize_all(new_transactions)
+        statistics.inserted += len(new_transactions)
+        statistics.categorized += len([t for t in new_transactions if t.category])
+        batch = list(itertools.islice(records, batch_size))
 
 
 logger = logging.getLogger(__name__)
 
 
+def _get_high_water_marks(bank):
+    """Returns the high-water marks (see _get_high_water_mark) of all accounts of given bank, by account name."""
+    return {account.name: _get_high_water_mark(account) for account in account_repository().get_accounts()
+            if account.bank == bank}
+
+
+def _get_high_water_mark(account):
+    """Returns the (lowest serial, highest serial, date of last transaction) of given account, if its serials form a
+    contiguous range, i.e. if every row with a serial in that range has already been imported. Returns None if the
+    account has no transactions or if its serials have gaps or duplicates (e.g. because an older export was imported
+    after a newer one), in which case every row must be fully checked."""
+    serials = [t.serial for t in account.get_transactions()]
+    if not serials or not all(isinstance(serial, int) for serial in serials):
+        return None
+    lowest, highest = min(serials), max(serials)
+    if highest - lowest + 1 != len(serials) or len(set(serials)) != len(serials):
+        logger.info("Serials of account %s are not contiguous, checking all rows for duplicates", account.name)
+        return None
+    return lowest, highest, account.get_last_transaction_date().isoformat()
+
+
+def _is_below_high_water_mark(row, high_water_mark):
+    """Returns True if given csv row has already been imported according to given high-water mark. Only the serial and
+    the (ISO formatted) date of the row are inspected, without further parsing."""
+    if not high_water_mark:
+        return False
+    lowest, highest, last_date = high_water_mark
+    try:
+        serial = int(row["Volgnr"])
+    except ValueError:
+        return False
+    return lowest <= serial <= highest and row["Rentedatum"] <= last_date
+
+
 def _get_or_create_account(account_name, bank):
     """Searches the repository for an account with given name and bank and returns it if found.
     Otherwise returns a new account object."""
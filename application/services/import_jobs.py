@@ -0,0 +1,100 @@
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+import uuid
+
+from application.services.data_import.rabobank import ImportStatistics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class ImportJob:
+    """Status of the background import of an uploaded file. The statistics are updated by the import itself, while it
+    is running."""
+
+    def __init__(self, job_id, filename):
+        self.id = job_id
+        self.filename = filename
+        self.state = QUEUED
+        self.error = None
+        self.statistics = ImportStatistics()
+        self.started = None
+        self.finished = None
+
+    def get_duration(self):
+        if not self.started:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def get_throughput(self):
+        """Returns the number of parsed rows per second."""
+        duration = self.get_duration()
+        return duration and self.statistics.rows_parsed / duration or 0.0
+
+    def to_dict(self):
+        return {"id": self.id, "state": self.state, "error": self.error,
+                "rows_parsed": self.statistics.rows_parsed, "inserted": self.statistics.inserted,
+                "duplicates": self.statistics.duplicates, "categorized": self.statistics.categorized,
+                "duration": round(self.get_duration(), 3), "rows_per_second": round(self.get_throughput(), 1)}
+
+    def __repr__(self):
+        return "{c}({id}, {state}, {statistics})".format(c=self.__class__.__name__, id=self.id, state=self.state,
+                                                         statistics=self.statistics)
+
+
+class ImportJobs:
+    """Runs imports of uploaded files in the background, one at a time. Keeps the status of the most recent jobs.
+
+    Other threads (e.g. request handlers) may use the repositories while a job runs. The repositories keep a separate
+    batch per thread, and a batch holds the lock of the database while it changes the cached accounts, transactions
+    and aggregates. Readers must hold the same lock (see AccountRepository.lock), as the application services do. A
+    reader thus waits for at most one batch of the import."""
+
+    def __init__(self, max_jobs=100):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._max_jobs = max_jobs
+
+    def submit(self, filename, import_function):
+        """Schedules import_function(filename, statistics) and returns the ImportJob. Given file is removed when the
+        import has finished."""
+        job = ImportJob(uuid.uuid4().hex, filename)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job, import_function)
+        logger.info("Scheduled %s", job)
+        return job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, import_function):
+        job.state = RUNNING
+        job.started = time.time()
+        try:
+            import_function(job.filename, job.statistics)
+            job.state = FINISHED
+        except Exception as e:
+            logger.exception("Import job %s failed", job.id)
+            job.error = str(e)
+            job.state = FAILED
+        finally:
+            job.finished = time.time()
+            os.remove(job.filename)
+        logger.info("Finished %s in %.2f seconds", job, job.get_duration())
+
+    def _forget_old_jobs(self):
+        """Drops the oldest finished jobs, while more than max_jobs are kept (dicts preserve insertion order)."""
+        finished = [job.id for job in self._jobs.values() if job.finished]
+        for job_id in finished[:max(0, len(self._jobs) - self._max_jobs)]:
+            del self._jobs[job_id]
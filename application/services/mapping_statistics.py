@@ -0,0 +1,101 @@
+import collections
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MapperStatistics:
+    """Counts the calls of one transaction mapper, the calls in which it matched a category, and the transactions of
+    which it decided the category (i.e. resolved the category that the transaction ends up with). Latencies are
+    accumulated; the percentiles are computed over the most recent max_samples calls."""
+
+    def __init__(self, name, max_samples=10000):
+        self.name = name
+        self.calls = 0
+        self.matches = 0
+        self.decisive = 0
+        self.total_time = 0.0
+        self._latencies = collections.deque(maxlen=max_samples)
+
+    def record(self, latency, matched):
+        self.calls += 1
+        self.total_time += latency
+        self._latencies.append(latency)
+        if matched:
+            self.matches += 1
+
+    def get_mean_latency(self):
+        return self.calls and self.total_time / self.calls or 0.0
+
+    def get_percentile_latency(self, percentile):
+        """Returns the latency (in seconds) below which given percentage of the sampled calls fall."""
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(math.ceil(percentile / 100 * len(latencies))) - 1)]
+
+    def to_dict(self):
+        return {"name": self.name, "calls": self.calls, "matches": self.matches, "decisive": self.decisive,
+                "total_time": round(self.total_time, 6), "mean_latency": self.get_mean_latency(),
+                "p95_latency": self.get_percentile_latency(95)}
+
+    def __repr__(self):
+        return "{c}({name}, calls={calls}, matches={matches}, decisive={decisive})".format(
+            c=self.__class__.__name__, **self.__dict__)
+
+
+class MappingStatistics:
+    """Instrumentation of the transaction mappers that categorize transactions: MapperStatistics per mapper (by mapper
+    instance, named after its class), and the number of transactions that were mapped."""
+
+    def __init__(self):
+        self._mappers = collections.OrderedDict()
+        self.transactions = 0
+        self.undecided = 0
+
+    def get_mapper_statistics(self, mapper):
+        statistics = self._mappers.get(id(mapper))
+        if statistics is None:
+            statistics = MapperStatistics(mapper.__class__.__name__)
+            self._mappers[id(mapper)] = statistics
+        return statistics
+
+    def get_category_scores(self, mapper, transaction):
+        """Returns the category scores of given mapper for given transaction, recording the latency of the call and
+        whether it matched a category."""
+        start = time.perf_counter()
+        category_scores = mapper.get_category_scores(transaction)
+        latency = time.perf_counter() - start
+        matched = bool(category_scores) and next(iter(category_scores)).category is not None
+        self.get_mapper_statistics(mapper).record(latency, matched)
+        return category_scores
+
+    def record_decision(self, mapper):
+        """Records that the category of a transaction was decided by given mapper (None if no mapper changed it)."""
+        self.transactions += 1
+        if mapper is None:
+            self.undecided += 1
+        else:
+            self.get_mapper_statistics(mapper).decisive += 1
+
+    def get_statistics(self):
+        return list(self._mappers.values())
+
+    def reset(self):
+        self._mappers.clear()
+        self.transactions = 0
+        self.undecided = 0
+
+    def log_summary(self, title="Transaction mapping"):
+        if not self.transactions:
+            return
+        logger.info("%s: %d transactions, of which %d not categorized by any mapper", title, self.transactions,
+                    self.undecided)
+        logger.info("    %-40s %9s %9s %9s %10s %10s %10s", "mapper", "calls", "matches", "decisive", "total (s)",
+                    "mean (ms)", "p95 (ms)")
+        for statistics in self._mappers.values():
+            logger.info("    %-40s %9d %9d %9d %10.3f %10.3f %10.3f", statistics.name, statistics.calls,
+                        statistics.matches, statistics.decisive, statistics.total_time,
+                        statistics.get_mean_latency() * 1000, statistics.get_percentile_latency(95) * 1000)
@@ -0,0 +1,107 @@
+import collections
+import concurrent.futures
+import csv
+import itertools
+import logging
+import os
+
+from application.services import transaction_mapping
+from domain.account_management.model.account import account_repository
+from domain.account_management.model.category import category_repository
+from domain.account_management.services import TransactionCategoryMapper
+
+logger = logging.getLogger(__name__)
+
+CategoryChange = collections.namedtuple("CategoryChange", ["transaction", "old_category", "new_category",
+                                                           "old_internal", "new_internal"])
+# The only attributes of a transaction that PatternTransactionCategoryMapper inspects
+_MatchKey = collections.namedtuple("_MatchKey", ["name", "description"])
+
+# The pattern mapper of a pool process (see _init_worker)
+_pattern_mapper = None
+
+
+def recategorize(transactions, pattern_mapper, mappers, internal_transactions_detector, dry_run=False,
+                 processes=None, batch_size=5000):
+    """Re-applies the mapper chain (given pattern mapper, followed by given other mappers) to given transactions, as a
+    CategorizationPipeline with the update flag set. Returns the list of CategoryChanges of the transactions of which
+    the category or internal flag changes.
+
+    The pattern matches only depend on the lowercase name and description, so they are computed once per distinct name
+    and description, partitioned across a pool of processes (unless processes is 1). The other mappers are applied by
+    this process. Unless dry_run is set, the changed transactions are saved in repository batches of given size."""
+    keys = list({(t.name.lower(), t.description.lower()): None for t in transactions})
+    logger.info("Matching patterns of %d distinct names and descriptions of %d transactions", len(keys),
+                len(transactions))
+    category_scores = _match_patterns(pattern_mapper, keys, processes)
+    pipeline = transaction_mapping.CategorizationPipeline(
+        [transaction_mapping.PrecomputedTransactionCategoryMapper(category_scores)] + list(mappers),
+        internal_transactions_detector)
+
+    changes = []
+    for transaction in transactions:
+        category, internal = pipeline.evaluate(transaction, update=True)
+        if category != transaction.category or internal != bool(transaction.internal):
+            changes.append(CategoryChange(transaction, transaction.category, category, bool(transaction.internal),
+                                          internal))
+    logger.info("Re-categorization changes %d of %d transactions", len(changes), len(transactions))
+    if not dry_run:
+        _save_changes(changes, batch_size)
+    return changes
+
+
+def _match_patterns(pattern_mapper, keys, processes):
+    """Returns the category scores of given pattern mapper for each of given (name, description) keys, by key."""
+    if processes == 1 or len(keys) < 2:
+        return {key: pattern_mapper.get_category_scores(_MatchKey(*key)) for key in keys}
+
+    # A few chunks per process, so that processes which finish early pick up some of the remaining work
+    chunk_size = max(1, -(-len(keys) // ((processes or os.cpu_count() or 1) * 4)))
+    chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker,
+                                                initargs=(pattern_mapper,)) as executor:
+        # The categories of the scores are returned by id, as unpickled categories are copies
+        results = itertools.chain.from_iterable(executor.map(_match_chunk, chunks))
+        return {key: [TransactionCategoryMapper.CategoryScore(
+            category_id and category_repository().get_category(category_id), score)
+            for category_id, score in scores] for key, scores in zip(keys, results)}
+
+
+def _init_worker(pattern_mapper):
+    global _pattern_mapper
+    _pattern_mapper = pattern_mapper
+
+
+def _match_chunk(keys):
+    return [[(cs.category and cs.category.id, cs.score) for cs in _pattern_mapper.get_category_scores(_MatchKey(*key))]
+            for key in keys]
+
+
+def _save_changes(changes, batch_size):
+    for start in range(0, len(changes), batch_size):
+        with account_repository().batch():
+            for change in changes[start:start + batch_size]:
+                transaction = change.transaction
+                if change.new_category != transaction.category:
+                    transaction.update_category(change.new_category)
+                if change.new_internal and not transaction.internal:
+                    transaction.set_internal(True)
+                account_repository().save_transaction(transaction)
+        logger.info("Saved %d of %d re-categorized transactions", min(start + batch_size, len(changes)), len(changes))
+
+
+def write_report(changes, text):
+    """Writes given CategoryChanges as csv to given file-like object, followed by the number of transactions per
+    (old category, new category) in the log."""
+    writer = csv.writer(text)
+    writer.writerow(["date", "account", "serial", "amount", "name", "description", "old_category", "new_category",
+                     "old_internal", "new_internal"])
+    for change in changes:
+        t = change.transaction
+        writer.writerow([t.date, t.account.name, t.serial, t.amount, t.name, t.description,
+                         change.old_category and change.old_category.qualified_name or "",
+                         change.new_category and change.new_category.qualified_name or "",
+                         int(change.old_internal), int(change.new_internal)])
+    counts = collections.Counter((change.old_category, change.new_category) for change in changes)
+    for (old_category, new_category), count in counts.most_common():
+        logger.info("%6d transactions: %s => %s", count, old_category, new_category)
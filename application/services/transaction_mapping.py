@@ -1,9 +1,12 @@
+import collections
 import csv
 import logging
+import os
 import re
+import time
 
 from domain.account_management.model.account import account_repository
-from domain.account_management.model.category import category_repository
+from domain.account_management.model.category import category_repository, get_category_tree_version
 from domain.account_management.services import TransactionCategoryMapper, InternalTransactionDetector
 
 logger = logging.getLogger(__name__)
@@ -46,26 +49,47 @@ class CategoryCleanupTransactionMapper(TransactionCategoryMapper):
 
 
 class MyInternalTransactionDetector(InternalTransactionDetector):
+    """Detects transactions to own accounts, i.e. transactions of which the counter account is the IBAN of an own
+    account, or the account number contained in that IBAN. These identifiers are collected again whenever the number of
+    accounts in the repository changes, which includes accounts that are saved in a batch that has not been written
+    yet (e.g. accounts created by the import that is being categorized)."""
+
+    def __init__(self):
+        self._own_account_identifiers = None
+        self._account_count = None
+
+    @staticmethod
+    def extract_accountnr_from_iban(iban):
+        m = re.search("^[A-Z]{2}[0-9]{2}[A-Z]+0*([0-9]+)$", iban)
+        if m:
+            return m.group(1)
+        else:
+            return iban
+
+    def _get_own_account_identifiers(self):
+        accounts = account_repository().get_accounts()
+        if self._own_account_identifiers is None or len(accounts) != self._account_count:
+            identifiers = set()
+            for account in accounts:
+                identifiers.add(account.name)
+                identifiers.add(self.extract_accountnr_from_iban(account.name))
+            self._own_account_identifiers = identifiers
+            self._account_count = len(accounts)
+        return self._own_account_identifiers
+
     def is_internal_transaction(self, transaction):
-        def extract_accountnr_from_iban(iban):
-            m = re.search("^[A-Z]{2}[0-9]{2}[A-Z]+0*([0-9]+)$", iban)
-            if m:
-                return m.group(1)
-            else:
-                return iban
+        return transaction.counter_account in self._get_own_account_identifiers()
 
-        for account in account_repository().get_accounts():
-            if account.name == transaction.counter_account or extract_accountnr_from_iban(
-                    account.name) == transaction.counter_account:
-                return True
-        return False
+    def get_internal_transactions(self, transactions):
+        own_account_identifiers = self._get_own_account_identifiers()
+        return [transaction for transaction in transactions if transaction.counter_account in own_account_identifiers]
 
 
 class InternalTransactionsMapper(TransactionCategoryMapper):
     """Maps transactions between own accounts to the 'Overboekingen' category."""
-    def __init__(self):
+    def __init__(self, internal_transactions_detector=None):
         self.DEFAULT_SCORE = 100
-        self.internal_transactions_detector = MyInternalTransactionDetector()
+        self.internal_transactions_detector = internal_transactions_detector or MyInternalTransactionDetector()
         self.internal_transactions_category = category_repository().get_category_by_qualified_name("Overboekingen")
 
     def get_category_scores(self, transaction):
@@ -85,22 +109,154 @@ def get_best_scoring_category(category_score_list):
     return category
 
 
-def map_transaction(transaction, transaction_mapper, update=False):
-    """Map given transaction using given transaction_mapper. If the update flag is set to True, then transactions which
-    have already been mapped will be updated. If the update flag is False, only uncategorized transactions will be
-    processed."""
-    category_scores = transaction_mapper.get_category_scores(transaction)
-    category = get_best_scoring_category(category_scores)
-    if category:
-        if (update or not transaction.category) and transaction.category != category:
+class CategorizationPipeline:
+    """Categorizes transactions with a list of transaction mappers and an internal transaction detector, saving every
+    changed transaction once.
+
+    The mappers are applied in order: the best scoring category of a mapper replaces the category resolved so far if
+    the update flag is set or no category has been resolved yet. Every mapper sees the category that was resolved by
+    the mappers before it (e.g. for CategoryCleanupTransactionMapper). Note that all mappers are evaluated, even if an
+    earlier mapper already resolved the category, because some mappers have side effects
+    (AfasTransactionCategoryMapper uses every AFAS transaction only once).
+
+    If MappingStatistics are given, every mapper call is recorded, as well as the mapper that resolved the category of
+    every transaction (by evaluate, which both resolve and categorize_all use)."""
+
+    def __init__(self, mappers, internal_transactions_detector, statistics=None):
+        self.mappers = mappers
+        self.internal_transactions_detector = internal_transactions_detector
+        self.statistics = statistics
+
+    def evaluate(self, transaction, update=False):
+        """Returns the (category, internal flag) that given transaction would be resolved to, without changing it."""
+        view = _ResolvedTransaction(transaction)
+        decisive = None
+        for mapper in self.mappers:
+            if self.statistics:
+                category_scores = self.statistics.get_category_scores(mapper, view)
+            else:
+                category_scores = mapper.get_category_scores(view)
+            category = get_best_scoring_category(category_scores)
+            if category and (update or not view.category):
+                view.category = category
+                decisive = mapper
+        if self.statistics:
+            self.statistics.record_decision(decisive)
+        internal = transaction.internal or self.internal_transactions_detector.is_internal_transaction(transaction)
+        return view.category, bool(internal)
+
+    def resolve(self, transaction, update=False):
+        """Resolves the category and internal flag of given transaction and updates the transaction accordingly.
+        Returns True if the transaction was changed (in which case the caller is responsible for saving it)."""
+        category, internal = self.evaluate(transaction, update)
+        changed = False
+        if category != transaction.category:
             transaction.update_category(category)
-            account_repository().save_transaction(transaction)
+            changed = True
+        if internal and not transaction.internal:
+            logger.debug("Flagging transaction as internal: %s", transaction)
+            transaction.set_internal(True)
+            changed = True
+        return changed
+
+    def categorize_all(self, transactions, update=False):
+        """Resolves the categories and internal flags of given transactions, and saves the changed transactions in one
+        repository batch. Returns the list of changed transactions."""
+        changed = [transaction for transaction in transactions if self.resolve(transaction, update)]
+        with account_repository().batch():
+            for transaction in changed:
+                account_repository().save_transaction(transaction)
+        return changed
+
+
+class PrecomputedTransactionCategoryMapper(TransactionCategoryMapper):
+    """Returns category scores that were computed beforehand (e.g. by a pool of processes), by the lowercase name and
+    description of the transaction. Transactions without precomputed scores get no scores."""
+
+    def __init__(self, category_scores):
+        self.category_scores = category_scores
+
+    def get_category_scores(self, transaction):
+        return self.category_scores.get((transaction.name.lower(), transaction.description.lower()), [])
+
+
+class _ResolvedTransaction:
+    """A transaction as seen by the mappers of a CategorizationPipeline: all attributes are those of the transaction,
+    except for the category, which is the category resolved so far."""
+
+    def __init__(self, transaction):
+        self._transaction = transaction
+        self.category = transaction.category
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+
+class SubstringAutomaton:
+    """Aho-Corasick automaton over a set of strings, which finds all of the strings that occur in a text in a single pass
+    over that text."""
+
+    def __init__(self, strings):
+        self._transitions = [{}]
+        self._outputs = [set()]
+        for string_id, string in enumerate(strings):
+            state = 0
+            for char in string:
+                next_state = self._transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self._transitions)
+                    self._transitions[state][char] = next_state
+                    self._transitions.append({})
+                    self._outputs.append(set())
+                state = next_state
+            self._outputs[state].add(string_id)
+
+        # Breadth-first, so the failure state (the longest proper suffix that is also a prefix) of the parent of every
+        # state is known when the state itself is visited
+        self._failures = [0] * len(self._transitions)
+        queue = collections.deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._transitions[state].items():
+                failure = self._failures[state]
+                while failure and char not in self._transitions[failure]:
+                    failure = self._failures[failure]
+                failure = self._transitions[failure].get(char, 0)
+                self._failures[next_state] = failure
+                self._outputs[next_state] |= self._outputs[failure]
+                queue.append(next_state)
+        self._outputs = [frozenset(output) for output in self._outputs]
+
+    def search(self, text):
+        """Returns the set of ids (indexes in the list of strings) of the strings that occur in given text."""
+        transitions, failures, outputs = self._transitions, self._failures, self._outputs
+        found = set(outputs[0])
+        state = 0
+        for char in text:
+            while state and char not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
 
 
 class PatternTransactionCategoryMapper(TransactionCategoryMapper):
+    """Maps transactions to the category of every rule in mapping.csv of which the name and description patterns match
+    the (lowercase) name and description of the transaction. A pattern matches if the regular expression '.*pattern.*'
+    matches from the start of the text. Patterns without regular expression syntax thus match if they occur in the first
+    line of the text; those are all looked up at once with a SubstringAutomaton."""
+
+    REGEX_CHARACTERS = frozenset(".^$*+?{}[]\\|()\n")
+
     def __init__(self, config):
+        self.mapping_filename = config.get_file("mapping.csv")
+        self.load()
+
+    def load(self):
+        """(Re)reads and compiles the rules from the mapping file."""
         self.names = {}
-        mapping_filename = config.get_file("mapping.csv")
+        mapping_filename = self.mapping_filename
         logger.info("Reading mapping from %s", mapping_filename)
         with open(mapping_filename, encoding="ISO-8859-1") as csv_file:
             reader = csv.DictReader(csv_file, delimiter=',')
@@ -114,6 +270,35 @@ class PatternTransactionCategoryMapper(TransactionCategoryMapper):
                     logger.warning("Failed to get category for %s", cat_name)
                     raise
                 self.names[(name, description)] = category
+        self._compile()
+
+    def _compile(self):
+        """Compiles the rules: every rule refers to its name and description pattern either by the id of the substring
+        in the name or description automaton, or by the compiled regular expression."""
+        self._rules = []
+        self._rules_by_name_substring = collections.defaultdict(list)
+        self._rules_by_name_regex = []
+        name_substrings, description_substrings = {}, {}
+        regex_count = 0
+        for index, ((name, description), category) in enumerate(self.names.items()):
+            name_pattern = self._compile_pattern(name.lower(), name_substrings)
+            description_pattern = self._compile_pattern(description.lower(), description_substrings)
+            self._rules.append((index, category, self.match_value(name, description), description_pattern))
+            if isinstance(name_pattern, int):
+                self._rules_by_name_substring[name_pattern].append(self._rules[-1])
+            else:
+                self._rules_by_name_regex.append((name_pattern, self._rules[-1]))
+            if not isinstance(name_pattern, int) or not isinstance(description_pattern, int):
+                regex_count += 1
+        self._name_automaton = SubstringAutomaton(list(name_substrings))
+        self._description_automaton = SubstringAutomaton(list(description_substrings))
+        logger.info("Compiled %d mapping rules (%d with regular expressions)", len(self._rules), regex_count)
+
+    def _compile_pattern(self, pattern, substrings):
+        if self.REGEX_CHARACTERS.isdisjoint(pattern):
+            return substrings.setdefault(pattern, len(substrings))
+        else:
+            return re.compile(".*%s.*" % pattern)
 
     @staticmethod
     def match_value(name, description):
@@ -126,15 +311,95 @@ class PatternTransactionCategoryMapper(TransactionCategoryMapper):
         return value
 
     def get_category_scores(self, transaction):
+        name = transaction.name.lower()
+        description = transaction.description.lower()
+        # '.*' does not match newlines, so substrings only match in the first line
+        found_names = self._name_automaton.search(name.partition("\n")[0])
+        found_descriptions = self._description_automaton.search(description.partition("\n")[0])
+
+        candidates = [rule for name_id in found_names for rule in self._rules_by_name_substring[name_id]]
+        candidates.extend(rule for name_regex, rule in self._rules_by_name_regex if name_regex.match(name))
         matches = []
-        for name, description in self.names.keys():
-            name_pattern = ".*%s.*" % name.lower()
-            description_pattern = ".*%s.*" % description.lower()
-            if re.match(name_pattern, transaction.name.lower()) and re.match(description_pattern,
-                                                                             transaction.description.lower()):
-                category = self.names[(name, description)]
-                score = self.match_value(name, description)
-                category_score = TransactionCategoryMapper.CategoryScore(category, score)
-                matches.append(category_score)
+        for index, category, score, description_pattern in sorted(candidates, key=lambda r: r[0]):
+            if isinstance(description_pattern, int):
+                matched = description_pattern in found_descriptions
+            else:
+                matched = description_pattern.match(description)
+            if matched:
+                matches.append(TransactionCategoryMapper.CategoryScore(category, score))
 
         return sorted(matches, key=lambda cs: cs.score, reverse=True)
+
+
+class MemoizingTransactionCategoryMapper(TransactionCategoryMapper):
+    """Memoizes the category scores of a deterministic mapper, i.e. a mapper of which the scores only depend on the
+    (case-insensitive) name and description and the counter account of a transaction, like
+    PatternTransactionCategoryMapper. At most maxsize results are kept, evicting the least recently used ones.
+
+    The memoized scores are dropped, and the mapper is reloaded, when its mapping file (checked at most once per
+    check_interval seconds) or the category tree changes."""
+
+    CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize", "invalidations"])
+
+    def __init__(self, mapper, maxsize=10000, check_interval=1.0):
+        self.mapper = mapper
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self._scores = collections.OrderedDict()
+        self._hits = self._misses = self._invalidations = 0
+        self._mapping_mtime = self._get_mapping_mtime()
+        self._category_tree = self._get_category_tree()
+        self._next_check = time.monotonic() + check_interval
+
+    def get_category_scores(self, transaction):
+        self._check_sources()
+        key = (transaction.name.lower(), transaction.description.lower(), transaction.counter_account)
+        category_scores = self._scores.get(key)
+        if category_scores is not None:
+            self._hits += 1
+            self._scores.move_to_end(key)
+        else:
+            self._misses += 1
+            category_scores = self.mapper.get_category_scores(transaction) or []
+            self._scores[key] = category_scores
+            if len(self._scores) > self.maxsize:
+                self._scores.popitem(last=False)
+        return list(category_scores)
+
+    def cache_info(self):
+        return self.CacheInfo(self._hits, self._misses, self.maxsize, len(self._scores), self._invalidations)
+
+    def get_hit_rate(self):
+        lookups = self._hits + self._misses
+        return lookups and self._hits / lookups or 0.0
+
+    def invalidate(self):
+        """Drops all memoized scores and reloads the mapper."""
+        logger.info("Invalidating memoized category scores of %s (%s)", self.mapper.__class__.__name__,
+                    self.cache_info())
+        self._scores.clear()
+        self._invalidations += 1
+        self.mapper.load()
+
+    def _check_sources(self):
+        category_tree = self._get_category_tree()
+        if category_tree != self._category_tree:
+            self._category_tree = category_tree
+            self.invalidate()
+        elif time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.check_interval
+            mapping_mtime = self._get_mapping_mtime()
+            if mapping_mtime != self._mapping_mtime:
+                self._mapping_mtime = mapping_mtime
+                self.invalidate()
+
+    def _get_mapping_mtime(self):
+        try:
+            return os.stat(self.mapper.mapping_filename).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _get_category_tree():
+        """Returns a value that changes when a category is added or moved."""
+        return get_category_tree_version(), len(category_repository().get_categories())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import argparse
+import datetime
+import decimal
+import logging
+import os
+import random
+import tempfile
+import time
+
+from dependency_injector import providers
+
+from domain.account_management.model.account import AccountFactory
+from domain.account_management.model.category import category_repository, CategoryFactory
+from infrastructure.repositories import Database
+from infrastructure.repositories.account_repository import AccountCache, DbAccountRepository
+from infrastructure.repositories.category_repository import CategoryCache, DbCategoryRepository
+
+logging.basicConfig(format='%(asctime)-15s %(levelname)-7s [%(name)s] %(message)s')
+logging.getLogger("").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+INDEXES = ["ix_transactions_account_date", "ix_transactions_category", "ix_categories_parent"]
+
+QUERIES = [
+    ("transactions of account in one month",
+     "SELECT * FROM transactions WHERE account = ? AND date >= ? AND date < ?", ("2012-05-01", "2012-06-01")),
+    ("transactions of category",
+     "SELECT COUNT(*) FROM transactions WHERE category = ?", ()),
+    ("subcategories of category",
+     "SELECT * FROM categories WHERE parent = ?", ()),
+]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def open_repositories(filename, profile):
+    db = Database(filename, profile)
+    categories = DbCategoryRepository(db, CategoryCache(db))
+    category_repository.override(providers.Object(categories))
+    return db, categories, DbAccountRepository(db, AccountCache(db))
+
+
+def drop_indexes(db):
+    """Drops the indexes of INDEXES. Note that constructing the repositories (re)creates them."""
+    for index in INDEXES:
+        db.connection.execute("DROP INDEX IF EXISTS %s" % index)
+
+
+def get_query_plan(db, sql, parameters):
+    return " / ".join(str(row[-1]) for row in db.query("EXPLAIN QUERY PLAN " + sql, parameters).fetchall())
+
+
+def load(filename, profile, use_indexes, transaction_count):
+    """Creates a database with given number of random transactions, in two accounts and a small category tree."""
+    random.seed(0)
+    db, categories, accounts = open_repositories(filename, profile)
+    if not use_indexes:
+        drop_indexes(db)
+    factory = AccountFactory()
+    category_factory = CategoryFactory(categories)
+    with categories.batch():
+        for qualified_name in ["Expenses::Groceries", "Expenses::Rent", "Income::Salary", "Income::Interest"]:
+            categories.save_category(category_factory.create_category_from_qualified_name(qualified_name))
+    category_list = list(categories.get_categories())
+    with accounts.batch():
+        account_list = [factory.create_account("NL%02dBANK0123456789" % i, "Bank") for i in range(2)]
+        for account in account_list:
+            accounts.save_account(account)
+        for serial in range(transaction_count):
+            account = account_list[serial % 2]
+            transaction = factory.create_transaction(account, datetime.date(2005, 1, 1) + datetime.timedelta(
+                days=serial * 5000 // transaction_count), decimal.Decimal("%.2f" % random.uniform(-100, 100)),
+                "Counterparty %d" % (serial % 100), "Description %d" % serial, serial, "NL99BANK%010d" % (serial % 50),
+                decimal.Decimal("1000.00"))
+            transaction.category = random.choice(category_list)
+            accounts.save_transaction(transaction)
+            account.add_transaction(transaction)
+    db.close()
+    return account_list[0].id, categories.get_category_by_qualified_name("Expenses").id
+
+
+def run(profile, use_indexes, transaction_count, directory):
+    filename = os.path.join(directory, "%s-%s.db" % (profile, use_indexes and "indexed" or "plain"))
+    (account_id, category_id), load_time = timed(load, filename, profile, use_indexes, transaction_count)
+
+    db, _, _ = open_repositories(filename, profile)
+    if not use_indexes:
+        drop_indexes(db)
+    _, startup_time = timed(AccountCache(db).init_cache)
+
+    logger.info("Profile '%s', %s:", profile, use_indexes and "with indexes" or "without indexes")
+    logger.info("    %-40s %8.3fs", "load (bulk insert)", load_time)
+    logger.info("    %-40s %8.3fs", "cache initialization", startup_time)
+    for description, sql, parameters in QUERIES:
+        key = account_id if "account" in sql else category_id
+        query_plan = get_query_plan(db, sql, (key,) + parameters)
+        logger.info("    %-40s %s", description + " (plan)", query_plan)
+        if not use_indexes and any(index in query_plan for index in INDEXES):
+            raise AssertionError("Query '%s' uses an index that should have been dropped" % sql)
+        start = time.perf_counter()
+        for _ in range(100):
+            db.query(sql, (key,) + parameters).fetchall()
+        logger.info("    %-40s %8.3fms", description + " (avg)", (time.perf_counter() - start) * 10)
+    db.close()
+
+
+def main(transaction_count):
+    """Reports load and query times of the database, with and without the performance profile and indexes."""
+    with tempfile.TemporaryDirectory() as directory:
+        run("default", False, transaction_count, directory)
+        run("default", True, transaction_count, directory)
+        run("performance", True, transaction_count, directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite storage profiles")
+    parser.add_argument("-n", "--transactions", type=int, default=100000, help="Number of transactions to load")
+    main(parser.parse_args().transactions)
@@ -1,11 +1,15 @@
 class Entity:
     """Superclass of all Entities (as in Domain Driven Design Entities). Entities may have domain events registered
     on them. These events need to be published by the infrastructure when the Entity is persisted (e.g. to the
-    database)."""
+    database).
+
+    Entities are slotted, and their list of domain events is only allocated once an event is registered, because
+    large numbers of (transaction) entities are kept in memory."""
+    __slots__ = ("id", "_domain_events")
 
     def __init__(self, entity_id):
         self.id = entity_id
-        self._domain_events = []
+        self._domain_events = None
 
     def register_domain_event(self, event):
         """Registers (adds) a new domain event on this entity. Domain events will be dispatched by the infrastructure
@@ -14,6 +18,8 @@ class Entity:
         See 2-step account_management-event publishing:
         https://paucls.wordpress.com/2018/05/31/ddd-aggregate-roots-and-domain-events-publication/
         """
+        if self._domain_events is None:
+            self._domain_events = []
         self._domain_events.append(event)
 
     def flush_domain_events(self):
@@ -24,8 +30,8 @@ class Entity:
         See 2-step account_management-event publishing:
         https://paucls.wordpress.com/2018/05/31/ddd-aggregate-roots-and-domain-events-publication/
         """
-        events = self._domain_events.copy()
-        self._domain_events.clear()
+        events = self._domain_events or []
+        self._domain_events = None
         return events
 
     def __eq__(self, other):
@@ -1,5 +1,8 @@
-import copy
+import bisect
+import contextlib
+import datetime
 import logging
+import sys
 import uuid
 
 from dependency_injector import providers
@@ -10,13 +13,16 @@ logger = logging.getLogger(__name__)
 
 
 class Account(Entity):
-    """Represents an account, registered at a specific bank. An account holds multiple transactions."""
+    """Represents an account, registered at a specific bank. An account holds multiple transactions, which are kept
+    ordered by date (transactions on the same date keep the order in which they were added)."""
 
     def __init__(self, account_id, name, bank):
         super().__init__(account_id)
         self.name = name
         self.bank = bank
         self.transactions = []
+        self._dates = []
+        self._indexed_dates = {}
 
     def __repr__(self):
         return "{c}(id={id}, name={name}, bank={bank!r}".format(
@@ -28,19 +34,12 @@ class Account(Entity):
 
     def get_combined_amount_for_category(self, category, date, mode='monthly'):
         """Returns the combined amount of transactions in the year or month specified by given date."""
-        matched_transactions = [t for t in self.transactions if
-                                (t.date.month == date.month or mode != 'monthly')
-                                and t.date.year == date.year
-                                and (t.category == category or (t.category and t.category.inherits_from(category)))]
-        return sum([t.amount for t in matched_transactions])
+        start_date, end_date = get_period(date, mode)
+        return sum([t.amount for t in self.get_transactions_for_category(start_date, end_date, category)])
 
     def get_combined_amount_for_category_in_month(self, category, date):
         """Returns the combined amount of transactions in the year and month specified by given date."""
-        matched_transactions = [t for t in self.transactions if
-                                t.date.month == date.month
-                                and t.date.year == date.year
-                                and (t.category == category or (t.category and t.category.inherits_from(category)))]
-        return sum([t.amount for t in matched_transactions])
+        return self.get_combined_amount_for_category(category, date, 'monthly')
 
     def get_balance_at(self, date):
         """Returns the account balance at given date."""
@@ -50,12 +49,23 @@ class Account(Entity):
         else:
             return 0
 
+    def get_balances_at(self, date_list):
+        """Returns the list of account balances at each of given dates, using a single sweep over the transactions in
+        date order."""
+        balances = [0] * len(date_list)
+        index = 0
+        for position, date in sorted(enumerate(date_list), key=lambda d: d[1]):
+            index = bisect.bisect_left(self._dates, date, index)
+            if index:
+                balances[position] = self.transactions[index - 1].balance_after
+        return balances
+
     def get_transactions(self, start_date=None, end_date=None):
         """Returns the list of transactions of given category that falls after given start_date (inclusive) and before
         given end_date (exclusive)"""
-        matched_transactions = [t for t in self.transactions if
-                                (not start_date or start_date <= t.date) and (not end_date or t.date < end_date)]
-        return matched_transactions
+        start = bisect.bisect_left(self._dates, start_date) if start_date else 0
+        end = bisect.bisect_left(self._dates, end_date) if end_date else len(self._dates)
+        return self.transactions[start:end]
 
     def get_transactions_for_category(self, start_date, end_date, category):
         """Returns the list of transactions of given category that falls after given start_date (inclusive) and before
@@ -67,46 +77,76 @@ class Account(Entity):
     def add_transaction(self, transaction):
         """Adds given transaction to this account. Note that the caller is responsible that transactions are only
         added once to an account."""
-        self.transactions.append(transaction)
+        index = bisect.bisect_right(self._dates, transaction.date)
+        self._dates.insert(index, transaction.date)
+        self.transactions.insert(index, transaction)
+        self._indexed_dates[transaction.id] = transaction.date
+
+    def remove_transaction(self, transaction):
+        """Removes the transaction with the same id as given transaction from this account. Transactions that have not
+        been added to this account are ignored."""
+        if transaction.id not in self._indexed_dates:
+            return
+        index = self._find_transaction(transaction)
+        del self._dates[index]
+        del self.transactions[index]
+        del self._indexed_dates[transaction.id]
+
+    def update_transaction(self, transaction):
+        """Replaces the transaction with the same id as given transaction, and moves it to its new position if its
+        date has changed. Transactions that have not been added to this account are ignored."""
+        if transaction.id not in self._indexed_dates:
+            return
+        index = self._find_transaction(transaction)
+        if self._indexed_dates[transaction.id] == transaction.date:
+            self.transactions[index] = transaction
+        else:
+            del self._dates[index]
+            del self.transactions[index]
+            self.add_transaction(transaction)
+
+    def _find_transaction(self, transaction):
+        """Returns the position of the (added) transaction with the same id as given transaction."""
+        indexed_date = self._indexed_dates[transaction.id]
+        start = bisect.bisect_left(self._dates, indexed_date)
+        end = bisect.bisect_right(self._dates, indexed_date)
+        return next(i for i in range(start, end) if self.transactions[i].id == transaction.id)
 
     def get_first_transaction_date(self):
         """Returns the date of the first transaction on this account."""
-        logger.debug("Getting first transaction date for account %s", self)
-        if self.transactions:
-            transaction = self.transactions[0]
-            for t in self.transactions:
-                if t.date < transaction.date:
-                    transaction = t
-            return transaction.date
+        if self._dates:
+            return self._dates[0]
         else:
             return None
 
     def get_last_transaction_date(self):
         """Returns the date of the last transaction on this account."""
-        logger.debug("Getting last transaction date for account %s", self)
-        if self.transactions:
-            transaction = self.transactions[0]
-            for t in self.transactions:
-                if t.date > transaction.date:
-                    transaction = t
-            return transaction.date
+        if self._dates:
+            return self._dates[-1]
         else:
             return None
 
     def _get_last_transaction_at_or_before(self, date):
-        """Returns the last transaction at given date, or the last transaction that occurred before this date, if
-        no transaction occurred on this specific date."""
-        logger.debug("Getting last transaction before %s for account %s", date, self)
-        if self.transactions:
-            transaction = self.transactions[0]
-            for t in self.transactions:
-                if transaction.date <= t.date < date:
-                    transaction = t
-            return transaction
+        """Returns the last transaction that occurred before given date, or None if there is no such transaction."""
+        index = bisect.bisect_left(self._dates, date)
+        if index:
+            return self.transactions[index - 1]
         else:
             return None
 
 
+def get_period(date, mode='monthly'):
+    """Returns the (start_date, end_date) tuple of the month (or the year, if mode is not 'monthly') that contains
+    given date. The start_date is inclusive, the end_date is exclusive."""
+    if mode == 'monthly':
+        start_date = datetime.date(date.year, date.month, 1)
+        end_date = datetime.date(date.year + date.month // 12, date.month % 12 + 1, 1)
+    else:
+        start_date = datetime.date(date.year, 1, 1)
+        end_date = datetime.date(date.year + 1, 1, 1)
+    return start_date, end_date
+
+
 class TransactionCategorizedEvent(DomainEvent):
     """Domain event that indicates that the category of a transaction is updated."""
 
@@ -152,7 +192,10 @@ class TransactionCreatedEvent(DomainEvent):
 
 
 class Transaction(Entity):
-    """Represents a transaction on a owned account."""
+    """Represents a transaction on a owned account. Transactions are slotted and intern their counterparty name and
+    account, since these recur in many transactions and all transactions are kept in memory."""
+    __slots__ = ("account", "serial", "date", "amount", "name", "description", "counter_account", "balance_after",
+                 "internal", "category")
 
     def __init__(self, transaction_id, account, serial, date, amount, name, description,
                  counter_account, balance_after, internal=False, category=None):
@@ -161,9 +204,9 @@ class Transaction(Entity):
         self.serial = serial
         self.date = date
         self.amount = amount
-        self.name = name
+        self.name = _intern(name)
         self.description = description
-        self.counter_account = counter_account
+        self.counter_account = _intern(counter_account)
         self.balance_after = balance_after
         self.internal = internal
         self.category = category
@@ -194,6 +237,13 @@ class Transaction(Entity):
         self.internal = internal
 
 
+def _intern(value):
+    if type(value) is str:
+        return sys.intern(value)
+    else:
+        return value
+
+
 class AccountRepository:
     """Repository to hold accounts and their transactions.
     Abstract class. Override with specific infrastructure."""
@@ -216,6 +266,29 @@ class AccountRepository:
     def save_transaction(self, transaction):
         raise NotImplementedError
 
+    def insert_transactions(self, transactions):
+        """Adds given new transactions to their accounts and saves them in bulk, e.g. to restore a backup. Only the
+        domain events that are registered on the transactions are published, so transactions that are not created by
+        the factory are not categorized again."""
+        with self.batch():
+            for transaction in transactions:
+                transaction.account.add_transaction(transaction)
+                self.save_transaction(transaction)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that groups all saves within it into a single unit of work, which is written (and whose
+        domain events are published) when the outermost batch ends. Repositories that do not support batching write
+        every save immediately."""
+        yield self
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Context manager that keeps other threads from changing the accounts and transactions of this repository
+        (e.g. by a batch) within it, so that they can be read consistently. Repositories that are not shared between
+        threads need no locking."""
+        yield self
+
 
 class AccountFactory:
     """Factory to create new Account and Transaction entities. Note that the caller is responsible to save the created
@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import uuid
 
@@ -8,28 +9,65 @@ from domain.account_management.model import Entity
 logger = logging.getLogger(__name__)
 
 
+_structure_version = 0
+_numbering = 0
+_numbered_structure_version = None
+
+
 class Category(Entity):
     """A transaction Category marks"""
 
     def __init__(self, category_id, name, parent=None):
         super().__init__(category_id)
         self.name = name
-        self.parent = parent
+        self._parent = parent
         self.children = []
+        self._tree_interval = None
+        self._qualified_name = None
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        if parent is not self._parent:
+            self._parent = parent
+            _invalidate_category_tree()
 
     @property
     def qualified_name(self):
+        """The '::'-separated names of this category and its ancestors. The qualified name is memoized until the
+        category tree changes."""
+        if self._qualified_name and self._qualified_name[1] == _structure_version:
+            return self._qualified_name[0]
         if self.parent:
             r = repr(self.parent) + "::"
         else:
             r = ""
-        return r + self.name
+        self._qualified_name = (r + self.name, _structure_version)
+        return self._qualified_name[0]
+
+    @property
+    def tree_interval(self):
+        """Returns the (left, right) nested-set interval of this category, or None if the category tree has not been
+        numbered (or has changed) since this category was numbered. A category inherits from another category if, and
+        only if, its interval lies strictly within the interval of the other category."""
+        if self._tree_interval and self._tree_interval[2] == _numbering \
+                and _numbered_structure_version == _structure_version:
+            return self._tree_interval[:2]
+        else:
+            return None
 
     def __repr__(self):
         return self.qualified_name
 
     def inherits_from(self, other_category):
         """Returns True if given other_category is an ancestor of this category. Returns False otherwise."""
+        interval = self.tree_interval
+        other_interval = isinstance(other_category, Category) and other_category.tree_interval
+        if interval and other_interval:
+            return other_interval[0] < interval[0] and interval[1] < other_interval[1]
         if self.parent:
             if self.parent == other_category:
                 return True
@@ -39,6 +77,53 @@ class Category(Entity):
             return False
 
 
+def number_category_tree(categories):
+    """(Re)assigns nested-set intervals to given categories and their ancestors, using a depth-first traversal of the
+    tree formed by their parent references. Intervals of categories outside this numbering become invalid."""
+    global _numbering, _numbered_structure_version
+    _numbering += 1
+    _numbered_structure_version = _structure_version
+
+    children = {}
+    roots = []
+    numbered = set()
+    pending = list(categories)
+    while pending:
+        category = pending.pop()
+        if id(category) in numbered:
+            continue
+        numbered.add(id(category))
+        if category.parent:
+            children.setdefault(id(category.parent), []).append(category)
+            pending.append(category.parent)
+        else:
+            roots.append(category)
+
+    counter = 0
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            category, visited = stack.pop()
+            if visited:
+                category._tree_interval = (category._tree_interval[0], counter, _numbering)
+            else:
+                category._tree_interval = (counter, None, _numbering)
+                stack.append((category, True))
+                stack.extend((child, False) for child in children.get(id(category), []))
+            counter += 1
+
+
+def get_category_tree_version():
+    """Returns a number that changes whenever a category is moved to another parent, i.e. whenever qualified names and
+    ancestry relations may have changed."""
+    return _structure_version
+
+
+def _invalidate_category_tree():
+    global _structure_version
+    _structure_version += 1
+
+
 class CategoryRepository:
     """Abstract class. Override with specific infrastructure."""
 
@@ -54,6 +139,12 @@ class CategoryRepository:
     def save_category(self, category):
         raise NotImplementedError
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that groups all saves within it into a single unit of work, which is written when the
+        outermost batch ends. Repositories that do not support batching write every save immediately."""
+        yield self
+
 
 class CategoryFactory:
     """Factory to create new Category entities. Note that the caller is responsible to save the created
@@ -68,14 +159,14 @@ class CategoryFactory:
         return category
 
     def create_category_from_qualified_name(self, qualified_name):
+        """Returns the category with given qualified name from the repository, or a new category with that name, of
+        which the ancestors that are not in the repository are new categories as well. New categories get their parent
+        when they are created, so the category tree version (see get_category_tree_version) does not change."""
         category = None
-        if not category:
-            next_parent = None
-            for name in qualified_name.split("::"):
-                tmp_category = self.create_category(name, next_parent)
-                category = self.repository.get_category_by_qualified_name(tmp_category.qualified_name) or tmp_category
-                category.parent = next_parent
-                next_parent = category
+        for name in qualified_name.split("::"):
+            category_name = category and category.qualified_name + "::" + name or name
+            category = self.repository.get_category_by_qualified_name(category_name) or \
+                Category(uuid.uuid4().hex, name, category)
         return category
 
 
@@ -9,6 +9,39 @@ def find_transactions_by_attributes(account, date, serial, amount, name, counter
             and t.description == description]
 
 
+class TransactionIndex:
+    """Hash index of transactions by their natural identity: account, date, serial, amount, name, counter account and
+    description. Finds the same transactions as find_transactions_by_attributes, but with a single lookup instead of a
+    scan of the account. Accounts are indexed the first time they are looked up."""
+
+    def __init__(self):
+        self._transactions = {}
+        self._indexed_accounts = set()
+
+    @staticmethod
+    def _key(account, date, serial, amount, name, counter_account, description):
+        # Amounts are compared as floats, see find_transactions_by_attributes
+        return account.id, date, serial, float(amount), name, counter_account, description
+
+    def find(self, account, date, serial, amount, name, counter_account, description):
+        """Returns all transactions in given account that exactly match given set of attributes."""
+        if account.id not in self._indexed_accounts:
+            self._indexed_accounts.add(account.id)
+            for transaction in account.get_transactions():
+                self.add(transaction)
+        return self._transactions.get(self._key(account, date, serial, amount, name, counter_account, description), [])
+
+    def add(self, transaction):
+        """Adds given transaction to the index, e.g. after it has been added to an account that is already indexed."""
+        if transaction.account.id not in self._indexed_accounts:
+            return
+        key = self._key(transaction.account, transaction.date, transaction.serial, transaction.amount, transaction.name,
+                        transaction.counter_account, transaction.description)
+        matches = self._transactions.setdefault(key, [])
+        if transaction not in matches:
+            matches.append(transaction)
+
+
 class TransactionCategoryMapper:
     """Superclass for mappers that can map a given transaction to one or more specific categories. Every category
     match is scored (numerical), where a higher score means a better match."""
@@ -29,3 +62,7 @@ class InternalTransactionDetector:
     def is_internal_transaction(self, transaction):
         """Returns True if, and only if, given transaction is an internal transaction (i.e. between own accounts)."""
         raise NotImplementedError
+
+    def get_internal_transactions(self, transactions):
+        """Returns the internal transactions (see is_internal_transaction) of given transactions."""
+        return [transaction for transaction in transactions if self.is_internal_transaction(transaction)]
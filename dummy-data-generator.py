@@ -9,6 +9,7 @@ from domain.account_management.model.account import AccountFactory
 from domain.account_management.model.category import Category, CategoryFactory
 from infrastructure.repositories.account_repository import AccountCache
 from infrastructure.repositories.category_repository import CategoryCache
+from infrastructure.repositories.table_export import get_fieldnames
 
 logging.basicConfig(format='%(asctime)-15s %(levelname)-7s [%(name)s] %(message)s')
 logging.getLogger("").setLevel(logging.INFO)
@@ -127,8 +128,20 @@ def main(output_directory):
     category_file = os.path.join(output_directory, "categories.csv")
     account_file = os.path.join(output_directory, "accounts.csv")
     transaction_file = os.path.join(output_directory, "transactions.csv")
-    application.services.data_export.native.export_categories(category_repo.get_categories(), category_file)
-    application.services.data_export.native.export_accounts(account_repo.get_accounts(), account_file, transaction_file)
+    export_rows = application.services.data_export.native.export_rows
+    export_rows(get_fieldnames("categories"), ((category.id, category.qualified_name)
+                                               for category in category_repo.get_categories()), category_file)
+    export_rows(get_fieldnames("accounts"), ((account.id, account.name, account.bank)
+                                             for account in account_repo.get_accounts()), account_file)
+    export_rows(get_fieldnames("transactions"), (_transaction_to_row(t) for account in account_repo.get_accounts()
+                                                 for t in account.get_transactions()), transaction_file)
+
+
+def _transaction_to_row(transaction):
+    """Returns given transaction in the column order of the native transactions.csv (see table_export)."""
+    return (transaction.id, transaction.amount, transaction.date, transaction.name, transaction.description,
+            transaction.balance_after, transaction.serial, transaction.counter_account, transaction.account.id,
+            int(bool(transaction.internal)), transaction.category and transaction.category.qualified_name or None)
 
 
 def create_transaction(category, year, month, account, serial):
@@ -1,5 +1,8 @@
 from datetime import datetime
 import logging
+import os
+import shutil
+import tempfile
 from decimal import Decimal
 
 from attr import dataclass
@@ -8,7 +11,7 @@ from flask_restful import Api
 from json import dumps, JSONEncoder
 from flask_cors import CORS
 from flask_compress import Compress
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
 
 import application.services
 from domain.account_management.model.category import category_repository
@@ -16,6 +19,8 @@ from domain.account_management.model.account import account_repository
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 app = Flask(__name__)
 CORS(app)
 Compress(app)
@@ -88,8 +93,7 @@ def get_category_data(category_id):
     mode = request.args.get('mode', 'monthly')
     category = category_repository().get_category(category_id)
     date_list = application.services.get_transaction_date_range(day_nr=1, mode=mode)
-    monthly_amounts = [application.services.get_combined_amount_for_category(category, month, mode) for
-                       month in date_list]
+    monthly_amounts = application.services.get_combined_amount_series_for_category(category, date_list, mode)
     response = app.response_class(
         response=dumps(
             [Balance(date, amount).__dict__ for (date, amount) in zip(date_list, monthly_amounts)], cls=CategoryEncoder),
@@ -123,8 +127,7 @@ def get_combined_category_data_for_period(parent_id=None):
     def get_category_amount(cat):
         cat_data = {
             'name': cat.name,
-            'value': abs(float(sum(
-                [float(t.amount) for t in application.services.get_transactions_for_category(start_date, end_date, cat)])))}
+            'value': abs(application.services.get_combined_amount_for_category_in_period(cat, start_date, end_date))}
 
         if cat.children:
             cat_data['children'] = []
@@ -148,9 +151,9 @@ def get_combined_data():
     category_id = request.args.get('category', None)
     category = category_repository().get_category(category_id)
     date_list = application.services.get_transaction_date_range(mode=mode)
-    balance_list = [application.services.get_combined_balance_at(date) for date in date_list]
+    balance_list = application.services.get_combined_balance_series(date_list)
     income, expenses, profit, loss = application.services.get_income_expenses_profit_loss(date_list, mode=mode)
-    category_amounts = [application.services.get_combined_amount_for_category(category, d, mode) for d in date_list]
+    category_amounts = application.services.get_combined_amount_series_for_category(category, date_list, mode)
     response = app.response_class(
         response=dumps(
             [Combined(date, balance, income, expenses, profit, loss, category_amount).__dict__ for
@@ -193,14 +196,37 @@ def get_transactions():
 
 @app.route('/upload', methods=['PUT'])
 def upload_csv():
-    csv_text = request.data
+    """Streams the uploaded csv-data to a temporary file and imports it in the background. Returns the id of the import
+    job, of which the progress is reported by /upload/<job_id>. The job removes the file when it has finished; the file
+    is removed here if no job could be started."""
+    upload_filename = None
     try:
-        logger.info('Received CSV data')
-        application.import_rabobank_transactions_from_csv(csv_text.decode('utf-8'))
-        return app.response_class()
+        with tempfile.NamedTemporaryFile(prefix="upload-", suffix=".csv", delete=False) as upload:
+            upload_filename = upload.name
+            shutil.copyfileobj(request.stream, upload, UPLOAD_CHUNK_SIZE)
+        logger.info('Received CSV data (%d bytes)', os.path.getsize(upload_filename))
+        job = application.start_rabobank_import_job(upload_filename)
     except Exception as e:
         logger.exception(e)
-        raise BadRequest('Failed to parse data: ' + str(e))
+        if upload_filename:
+            os.remove(upload_filename)
+        raise BadRequest('Failed to receive data: ' + str(e))
+    return app.response_class(
+        response=dumps({"job_id": job.id}),
+        status=202,
+        mimetype='application/json'
+    )
+
+
+@app.route('/upload/<string:job_id>')
+def get_upload_status(job_id):
+    job = application.get_import_job(job_id)
+    if not job:
+        raise NotFound('Unknown import job: ' + job_id)
+    return app.response_class(
+        response=dumps(job.to_dict()),
+        mimetype='application/json'
+    )
 
 
 @app.route('/transactions/<string:transaction_id>/set_category', methods=['PUT'])
@@ -1,6 +1,10 @@
+import contextlib
 import decimal
 import logging
+import os
 import sqlite3
+import threading
+import sqlalchemy
 from sqlalchemy import create_engine, MetaData
 from dependency_injector import providers
 from domain import Blackboard
@@ -47,28 +51,144 @@ class DatabaseSqlite3:
         return row
 
 
+STORAGE_PROFILES = {
+    # SQLite defaults: rollback journal, full synchronous writes, 2MB page cache
+    "default": {},
+    # Write-ahead logging, which only needs to sync the log at checkpoints, a 64MB page cache, a 256MB memory-mapped
+    # I/O window and temporary tables and indexes (e.g. for sorting) in memory.
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+}
+
+
 class Database:
-    def __init__(self):
-        self.engine = create_engine("sqlite:///bank-sqlite3.db?"
-                                    "check_same_thread=false")
+    """SQLAlchemy based database connection. The storage profile (one of STORAGE_PROFILES) determines the SQLite
+    pragmas that are set on every connection, and defaults to the DATABASE_PROFILE environment variable."""
+
+    def __init__(self, filename="bank-sqlite3.db", profile=None):
+        self.profile = profile or os.environ.get("DATABASE_PROFILE", "performance")
+        if self.profile not in STORAGE_PROFILES:
+            raise ValueError("Unknown database profile '%s' (use one of %s)" % (self.profile,
+                                                                              ", ".join(STORAGE_PROFILES)))
+        self.engine = create_engine("sqlite:///%s?"
+                                    "check_same_thread=false" % filename)
+        logger.info("Using '%s' database profile for %s", self.profile, filename)
+        sqlalchemy.event.listen(self.engine, "connect", self._apply_storage_profile)
         self.meta = MetaData()
         self.connection = self.engine.connect()
+        # The connection is shared by all threads (e.g. request handlers and import jobs), so every use of it is
+        # serialized; reentrant, because queries and nested writes happen within database transactions
+        self.lock = threading.RLock()
+
+    def _apply_storage_profile(self, dbapi_connection, connection_record):
+        logger.debug("Applying '%s' database profile to new connection", self.profile)
+        cursor = dbapi_connection.cursor()
+        for pragma, value in STORAGE_PROFILES[self.profile].items():
+            cursor.execute("PRAGMA %s = %s" % (pragma, value))
+        cursor.close()
+
+    def create_index(self, name, table, columns):
+        """Creates the index with given name on given columns of given table, unless it already exists. This also
+        migrates existing databases, that were created without the index."""
+        self.connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (name, table, ", ".join(columns)))
 
     def close(self):
         self.connection.close()
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """Holds the lock of the connection for the duration of a database transaction on it."""
+        with self.lock, self.connection.begin():
+            yield self.connection
+
     def query(self, query, parameters=()):
-        result = self.connection.execute(query, parameters)
+        with self.lock:
+            result = self.connection.execute(query, parameters)
         return result
 
     def query_one(self, query, parameters=()):
-        result = self.connection.execute(query, parameters)
-        return next(result)
+        with self.lock:
+            result = self.connection.execute(query, parameters)
+            return next(result)
 
     def get_engine(self):
         return self.engine
 
 
+class UnitOfWork:
+    """Collects the entities that are saved within a repository batch, so that they can be written to the database in
+    bulk when the batch ends. Entities saved more than once within a batch are written once.
+
+    Saving an entity also changes the in-memory state of the repository (e.g. its cache) right away. The actions that
+    undo those changes are kept until the entities are written, so that a failed batch can be rolled back."""
+
+    def __init__(self):
+        self._dirty = {}
+        self._undo = []
+
+    def __bool__(self):
+        return any(self._dirty.values())
+
+    def register(self, table_name, entity, undo=None):
+        """Registers given entity to be written to given table. Given undo action (if any) is kept for the first
+        registration of the entity since it was last written."""
+        entities = self._dirty.setdefault(table_name, {})
+        if undo and entity.id not in entities:
+            self._undo.append(undo)
+        entities[entity.id] = entity
+
+    def take(self, table_name):
+        """Returns the list of entities registered for given table (in the order in which they were first saved) and
+        removes them from this unit of work."""
+        return list(self._dirty.pop(table_name, {}).values())
+
+    def written(self):
+        """Forgets the undo actions of the entities that were taken, after they have been written."""
+        self._undo = []
+
+    def rollback(self):
+        """Undoes the in-memory changes of the entities that have not been written, in reverse order, and discards
+        them."""
+        self._dirty.clear()
+        while self._undo:
+            self._undo.pop()()
+
+
+class ThreadLocalUnitOfWork:
+    """Descriptor for the UnitOfWork of a repository batch, that holds a separate unit of work per thread, so that
+    saves from one thread are never registered into (or lost from) the batch of another thread."""
+
+    def __get__(self, repository, owner=None):
+        if repository is None:
+            return self
+        return getattr(self._get_local(repository), "unit_of_work", None)
+
+    def __set__(self, repository, unit_of_work):
+        self._get_local(repository).unit_of_work = unit_of_work
+
+    @staticmethod
+    def _get_local(repository):
+        return repository.__dict__.setdefault("_thread_local", threading.local())
+
+
+def bulk_upsert(connection, table, rows):
+    """Writes given rows (dicts of column values, including the 'id' primary key) to given table, using one bulk
+    update of the existing rows followed by one bulk insert of the new rows. Unlike INSERT OR REPLACE, this keeps the
+    rowid (and thus the insertion order) of existing rows."""
+    if not rows:
+        return
+    columns = [column for column in rows[0].keys() if column != "id"]
+    update = table.update().where(table.c.id == sqlalchemy.bindparam("_id")).values(
+        {column: sqlalchemy.bindparam("_" + column) for column in columns})
+    connection.execute(update, [{"_" + column: value for column, value in row.items()} for row in rows])
+    connection.execute(table.insert().prefix_with("OR IGNORE"), rows)
+
+
 blackboard = Blackboard()
 
 
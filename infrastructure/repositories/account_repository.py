@@ -1,11 +1,15 @@
+import contextlib
+import datetime
+import functools
+import itertools
 import logging
-from datetime import datetime
+import time
 import sqlalchemy
 from dependency_injector import providers
 
 from domain.account_management.model.account import AccountRepository, Account, Transaction, account_repository
 from domain.account_management.model.category import category_repository
-from infrastructure.repositories import blackboard
+from infrastructure.repositories import blackboard, UnitOfWork, ThreadLocalUnitOfWork, bulk_upsert
 from infrastructure.services import publish_domain_events
 
 logger = logging.getLogger(__name__)
@@ -29,8 +33,26 @@ class AccountCache(AccountRepository):
         assert self.transactions[transaction.id] is transaction
 
         stored_account = self.get_account(transaction.account.id)
-        stored_account.transactions = [transaction if transaction.id == t.id else t
-                                       for t in stored_account.transactions]
+        stored_account.update_transaction(transaction)
+
+    def insert_transaction(self, transaction):
+        """Adds given new transaction to the cache and to its (cached) account."""
+        self.transactions[transaction.id] = transaction
+        self.get_account(transaction.account.id).add_transaction(transaction)
+
+    def remove_account(self, account):
+        """Removes given account from the cache, e.g. when the batch that saved it failed."""
+        if self.accounts.get(account.id) is account:
+            del self.accounts[account.id]
+
+    def remove_transaction(self, transaction):
+        """Removes given transaction from the cache and from its (cached) account, e.g. when the batch that saved it
+        failed."""
+        if self.transactions.get(transaction.id) is transaction:
+            del self.transactions[transaction.id]
+        account = self.get_account(transaction.account.id)
+        if account:
+            account.remove_transaction(transaction)
 
     def get_accounts(self):
         return self.accounts.values()
@@ -51,74 +73,174 @@ class AccountCache(AccountRepository):
         else:
             return None
 
-    def init_cache(self):
+    def init_cache(self, batch_size=10000):
+        """Loads all accounts and transactions from the database. Transactions are streamed in a single query, ordered
+        by account and date, so they can be appended to the date index of their account."""
         logger.info("Initializing cache...")
+        start_time = time.perf_counter()
         sql = """SELECT * FROM accounts"""
         account_rows = self.db.query(sql)
         for row in account_rows:
             account = Account(row["id"], row["name"], row["bank"])
             self.save_account(account)
 
-            logger.debug("Fetching transactions for account %s", account)
-            for trow in self.db.query("SELECT * FROM transactions WHERE account = ?", (account.id,)):
-                category = category_repository().get_category(trow["category"])
-                date_str = trow["date"].split(" ")[0] # strip trailing characters (if any)
-                date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                transaction = Transaction(trow["id"], account, trow["serial"], date,
-                                          trow["amount"], trow["name"], trow["description"], trow["counter_account"],
-                                          trow["balance_after"], trow["internal"], category)
-                self.save_transaction(transaction)
+        categories = {category.id: category for category in category_repository().get_categories()}
+        dates = {}
+        result = self.db.query("SELECT id, account, serial, date, amount, name, description, counter_account, "
+                               "balance_after, internal, category FROM transactions ORDER BY account, date, rowid")
+        rows = result.fetchmany(batch_size)
+        while rows:
+            for (transaction_id, account_id, serial, date_str, amount, name, description, counter_account,
+                 balance_after, internal, category_id) in rows:
+                account = self.accounts.get(account_id)
+                if not account:
+                    logger.warning("Skipping transaction %s of unknown account %s", transaction_id, account_id)
+                    continue
+                date = dates.get(date_str)
+                if not date:
+                    # Parse the date part only, dropping trailing characters (if any)
+                    date = datetime.date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+                    dates[date_str] = date
+                transaction = Transaction(transaction_id, account, serial, date, amount, name, description,
+                                          counter_account, balance_after, internal, categories.get(category_id))
+                self.transactions[transaction_id] = transaction
                 account.add_transaction(transaction)
+            rows = result.fetchmany(batch_size)
 
-        logger.info("Cache initialized...")
+        logger.info("Cache initialized with %d accounts and %d transactions in %.2f seconds", len(self.accounts),
+                    len(self.transactions), time.perf_counter() - start_time)
 
 
 class DbAccountRepository(AccountRepository):
     """
     TODO: Consider incorporating an ORM, instead of using my own cache.
     """
+    _unit_of_work = ThreadLocalUnitOfWork()
 
     def __init__(self, db, cache):
         logger.info("Creating %s", self.__class__)
         self.db = db
         self._cache = cache
+        self._unit_of_work = None
         self._create_tables()
         self._cache.init_cache()
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups all saves within this context into a single unit of work. When the outermost batch ends, the saved
+        accounts and transactions are written in bulk inside one database transaction, after which their domain events
+        are published. Entities saved by the event handlers are collected and written in the same way, until no more
+        changes are left.
+
+        If the context (or writing the unit of work) raises an exception, the entities that have not been written are
+        rolled back: new accounts and transactions are removed from the cache (and from their account), and the
+        category and internal flag of existing transactions are read back from the database.
+
+        The cached accounts and transactions (and whatever the event handlers update) change during the whole batch, so
+        the outermost batch holds the lock of the database (see lock)."""
+        if self._unit_of_work is not None:
+            yield self
+            return
+
+        with self.db.lock:
+            self._unit_of_work = UnitOfWork()
+            try:
+                yield self
+                self._commit()
+            except:
+                self._unit_of_work.rollback()
+                raise
+            finally:
+                self._unit_of_work = None
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Holds the lock of the database, which every batch holds while it changes the cache."""
+        with self.db.lock:
+            yield self
+
     def save_account(self, account):
-        if self.get_account(account.id):
-            statement = self.db_accounts.update().where(self.db_accounts.id == account.id).values(name=account.c.name,
-                                                                                                  bank=account.c.bank)
-            self.db.connection.execute(statement)
-        else:
-            statement = self.db_accounts.insert().values(id=account.id, name=account.name, bank=account.bank)
-            self.db.connection.execute(statement)
-        if self._cache:
-            self._cache.save_account(account)
-        publish_domain_events(account.flush_domain_events())
+        with self.batch():
+            undo = None
+            if self._cache and not self._cache.get_account(account.id):
+                undo = functools.partial(self._forget_account, account)
+            self._unit_of_work.register("accounts", account, undo)
+            if self._cache:
+                self._cache.save_account(account)
+        return account
 
     def save_transaction(self, transaction):
-        if self.get_transaction(transaction.id):
-            statement = self.db_transactions.update().where(self.db_transactions.c.id == transaction.id).values(
-                amount=transaction.amount, date=transaction.date, name=transaction.name,
-                description=transaction.description, balance_after=transaction.balance_after, serial=transaction.serial,
-                counter_account=transaction.counter_account, account=transaction.account.id,
-                internal=transaction.internal, category=transaction.category and transaction.category.id or None
-            )
-            self.db.connection.execute(statement)
-        else:
-            statement = self.db_transactions.insert().values(
-                id=transaction.id, amount=transaction.amount, date=transaction.date, name=transaction.name,
-                description=transaction.description, balance_after=transaction.balance_after, serial=transaction.serial,
-                counter_account=transaction.counter_account, account=transaction.account.id,
-                internal=transaction.internal, category=transaction.category and transaction.category.id or None
-            )
-            self.db.connection.execute(statement)
+        with self.batch():
+            undo = None
+            if self._cache:
+                if self._cache.get_transaction(transaction.id) is None:
+                    undo = functools.partial(self._forget_transaction, transaction)
+                else:
+                    undo = functools.partial(self._reload_transaction, transaction)
+            self._unit_of_work.register("transactions", transaction, undo)
+            if self._cache:
+                self._cache.save_transaction(transaction)
+        return transaction
+
+    def _forget_account(self, account):
+        account.flush_domain_events()
+        self._cache.remove_account(account)
+
+    def _forget_transaction(self, transaction):
+        transaction.flush_domain_events()
+        self._cache.remove_transaction(transaction)
+
+    def _reload_transaction(self, transaction):
+        """Restores the category and internal flag of given (cached) transaction to those in the database."""
+        transaction.flush_domain_events()
+        row = self.db.query_one("SELECT internal, category FROM transactions WHERE id=?", (transaction.id,))
+        transaction.internal = row["internal"]
+        transaction.category = row["category"] and category_repository().get_category(row["category"]) or None
+
+    def insert_transactions(self, transactions, batch_size=10000):
+        """Inserts given new transactions in chunks of given size, inside one database transaction, without the update
+        of existing rows that a batch performs and without publishing domain events. Rows are passed as plain tuples,
+        which avoids compiling the statement for every chunk. The transactions are added to the cache once the
+        database transaction has been committed."""
+        sql = "INSERT INTO transactions (id, amount, date, name, description, balance_after, serial, " \
+              "counter_account, account, internal, category) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        transactions = iter(transactions)
+        inserted = []
+        with self.db.transaction() as connection:
+            chunk = list(itertools.islice(transactions, batch_size))
+            while chunk:
+                connection.execute(sql, [(t.id, t.amount, t.date.isoformat(), t.name, t.description,
+                                          t.balance_after, t.serial, t.counter_account, t.account.id,
+                                          t.internal, t.category and t.category.id or None) for t in chunk])
+                inserted.extend(chunk)
+                chunk = list(itertools.islice(transactions, batch_size))
         if self._cache:
-            self._cache.save_transaction(transaction)
+            with self.db.lock:
+                for transaction in inserted:
+                    self._cache.insert_transaction(transaction)
+        logger.info("Inserted %d transactions", len(inserted))
 
-        publish_domain_events(transaction.flush_domain_events())
-        return transaction
+    def _commit(self):
+        while self._unit_of_work:
+            accounts = self._unit_of_work.take("accounts")
+            transactions = self._unit_of_work.take("transactions")
+            logger.debug("Writing %d accounts and %d transactions", len(accounts), len(transactions))
+            with self.db.transaction() as connection:
+                bulk_upsert(connection, self.db_accounts,
+                            [{"id": a.id, "name": a.name, "bank": a.bank} for a in accounts])
+                bulk_upsert(connection, self.db_transactions,
+                            [self._transaction_to_row(t) for t in transactions])
+            self._unit_of_work.written()
+            for entity in accounts + transactions:
+                publish_domain_events(entity.flush_domain_events())
+
+    @staticmethod
+    def _transaction_to_row(transaction):
+        return {"id": transaction.id, "amount": transaction.amount, "date": transaction.date, "name": transaction.name,
+                "description": transaction.description, "balance_after": transaction.balance_after,
+                "serial": transaction.serial, "counter_account": transaction.counter_account,
+                "account": transaction.account.id, "internal": transaction.internal,
+                "category": transaction.category and transaction.category.id or None}
 
     def get_accounts(self):
         if self._cache:
@@ -214,6 +336,8 @@ class DbAccountRepository(AccountRepository):
                                                                       sqlalchemy.ForeignKey('categories.id'))
                                                     )
         meta.create_all(self.db.get_engine())
+        self.db.create_index("ix_transactions_account_date", "transactions", ["account", "date"])
+        self.db.create_index("ix_transactions_category", "transactions", ["category"])
 
 
 def init():
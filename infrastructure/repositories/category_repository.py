@@ -1,9 +1,12 @@
+import contextlib
+import functools
 import logging
 import sqlite3
 import sqlalchemy
 from dependency_injector import providers
-from domain.account_management.model.category import CategoryRepository, Category, category_repository
-from infrastructure.repositories import blackboard
+from domain.account_management.model.category import CategoryRepository, Category, category_repository, \
+    number_category_tree, get_category_tree_version
+from infrastructure.repositories import blackboard, UnitOfWork, ThreadLocalUnitOfWork, bulk_upsert
 
 logger = logging.getLogger(__name__)
 
@@ -12,28 +15,51 @@ class CategoryCache(CategoryRepository):
     def __init__(self, db):
         self.db = db
         self.categories = {}
+        self._categories_by_id = {}
+        self._tree_version = get_category_tree_version()
 
     def save_category(self, category):
+        self._refresh_qualified_names()
         if category.qualified_name not in self.categories.keys():
             logger.debug("Adding category %s (id=%s) to cache", category, category.id)
             self.categories[category.qualified_name] = category
         logger.debug("Updating category %s (categories: %s)", category, self.categories)
         assert category is self.categories[category.qualified_name]
+        self._categories_by_id[category.id] = category
         return category
 
+    def remove_category(self, category):
+        """Removes given category from the cache and from the children of its parent, e.g. when the batch that saved it
+        failed."""
+        self._refresh_qualified_names()
+        if self.categories.get(category.qualified_name) is category:
+            del self.categories[category.qualified_name]
+        if self._categories_by_id.get(category.id) is category:
+            del self._categories_by_id[category.id]
+        if category.parent and category in category.parent.children:
+            category.parent.children.remove(category)
+
+    def number_categories(self):
+        """Numbers the nested-set intervals of the cached categories. Saving or removing categories does not do this,
+        so it is done once after the cache is loaded and after each batch; until then inherits_from walks the parents
+        of the new categories."""
+        number_category_tree(self.categories.values())
+
     def get_categories(self):
         return self.categories.values()
 
     def get_category_by_qualified_name(self, qualified_name):
-        cached = next(iter(c for c in self.categories.values() if c.qualified_name == qualified_name), None)
-        return cached
+        self._refresh_qualified_names()
+        return self.categories.get(qualified_name)
 
     def get_category(self, category_id):
-        for cat in self.categories.values():
-            if cat.id == category_id:
-                return cat
-        else:
-            return None
+        return self._categories_by_id.get(category_id)
+
+    def _refresh_qualified_names(self):
+        """Re-indexes the categories by qualified name if a category was moved since they were last indexed."""
+        if self._tree_version != get_category_tree_version():
+            self.categories = {c.qualified_name: c for c in self.categories.values()}
+            self._tree_version = get_category_tree_version()
 
     def init_cache(self):
         sql = """SELECT * FROM categories"""
@@ -70,17 +96,50 @@ class CategoryCache(CategoryRepository):
                     self.save_category(parent)
         except sqlite3.Error as e:
             logger.warning("%s: No data from database: %s", self, e)
+        self.number_categories()
         logger.info("Cache initialized...")
 
 
 class DbCategoryRepository(CategoryRepository):
+    _unit_of_work = ThreadLocalUnitOfWork()
+
     def __init__(self, db, cache):
         logger.info("Creating %s", self.__class__)
         self.db = db
         self._cache = cache
+        self._unit_of_work = None
         self._create_tables()
         self._cache.init_cache()
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Groups all saves within this context into a single unit of work, that is written in bulk inside one
+        database transaction when the outermost batch ends. If the context (or writing the unit of work) raises an
+        exception, nothing is written and the new categories are removed from the cache again. Like the batches of the
+        account repository, the outermost batch holds the lock of the database while it changes the cache. When it ends,
+        it numbers the category tree of the cache once for all categories saved in it."""
+        if self._unit_of_work is not None:
+            yield self
+            return
+
+        with self.db.lock:
+            self._unit_of_work = UnitOfWork()
+            try:
+                yield self
+                categories = self._unit_of_work.take("categories")
+                logger.debug("Writing %d categories", len(categories))
+                with self.db.transaction() as connection:
+                    bulk_upsert(connection, self.db_categories,
+                                [{"id": c.id, "name": c.name, "parent": c.parent and c.parent.id or None}
+                                 for c in categories])
+                self._unit_of_work.written()
+            except:
+                self._unit_of_work.rollback()
+                raise
+            finally:
+                self._unit_of_work = None
+                self._cache.number_categories()
+
     def get_category_by_qualified_name(self, qualified_name):
         return self._cache.get_category_by_qualified_name(qualified_name)
 
@@ -91,19 +150,19 @@ class DbCategoryRepository(CategoryRepository):
     def get_categories(self):
         return self._cache.get_categories()
 
-    def save_category(self, category, session=None):
+    def save_category(self, category):
         logger.debug("%s: update_category(%s (id=%s))", self, category, category.id)
-        if not self.get_category_by_qualified_name(category.qualified_name):
-            logger.debug("%s: Creating new database entry %s (id=%s)", self, category, category.id)
-            statement = self.db_categories.insert().values(id=category.id, name=category.name,
-                                               parent=category.parent and category.parent.id or None).execution_options(autocommit=True)
-            self.db.connection.execute(statement)
-        if category.parent and not self.get_category_by_qualified_name(category.parent.qualified_name):
-            if category not in category.parent.children:
-                category.parent.children.append(category)
-            self.save_category(category.parent)
-
-        self._cache.save_category(category)
+        with self.batch():
+            if not self.get_category_by_qualified_name(category.qualified_name):
+                logger.debug("%s: Creating new database entry %s (id=%s)", self, category, category.id)
+                self._unit_of_work.register("categories", category,
+                                            functools.partial(self._cache.remove_category, category))
+            if category.parent and not self.get_category_by_qualified_name(category.parent.qualified_name):
+                if category not in category.parent.children:
+                    category.parent.children.append(category)
+                self.save_category(category.parent)
+
+            self._cache.save_category(category)
 
     def _create_tables(self):
         meta = self.db.meta
@@ -116,6 +175,7 @@ class DbCategoryRepository(CategoryRepository):
                                                   sqlalchemy.Column('parent', sqlalchemy.Text,
                                                                     sqlalchemy.ForeignKey('categories.id')))
         meta.create_all(self.db.engine)
+        self.db.create_index("ix_categories_parent", "categories", ["parent"])
 
 
 def init():
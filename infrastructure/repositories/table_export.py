@@ -0,0 +1,47 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Qualified names of all categories, derived from the parent relation
+_QUALIFIED_CATEGORIES = """
+    WITH RECURSIVE qualified_categories(id, qualified_name) AS (
+        SELECT id, name FROM categories WHERE parent IS NULL
+        UNION ALL
+        SELECT c.id, q.qualified_name || '::' || c.name
+        FROM categories c JOIN qualified_categories q ON c.parent = q.id)
+    """
+
+TABLES = {
+    "accounts": (["account_id", "name", "bank"],
+                 "SELECT id, name, bank FROM accounts ORDER BY rowid"),
+    "categories": (["category_id", "qualified_name"],
+                   _QUALIFIED_CATEGORIES + "SELECT id, qualified_name FROM qualified_categories"),
+    "transactions": (["transaction_id", "amount", "date", "name", "description", "balance_after", "serial",
+                      "counter_account", "account", "internal", "category"],
+                     _QUALIFIED_CATEGORIES +
+                     "SELECT t.id, t.amount, substr(t.date, 1, 10), t.name, t.description, t.balance_after, t.serial, "
+                     "t.counter_account, t.account, COALESCE(t.internal, 0), q.qualified_name "
+                     "FROM transactions t LEFT JOIN qualified_categories q ON t.category = q.id "
+                     "ORDER BY t.account, t.date, t.rowid"),
+}
+
+
+def get_fieldnames(table):
+    """Returns the column names of given table ('accounts', 'categories' or 'transactions') in native exports."""
+    return TABLES[table][0]
+
+
+def iter_rows(db, table, batch_size=10000):
+    """Streams the rows of given table from the database as plain tuples (in the column order of get_fieldnames),
+    fetching them in chunks of given size. Transactions are ordered by account and date, and refer to their category
+    by qualified name, so the repositories need not be loaded. Dates are exported without the time part that some
+    legacy rows have (see AccountCache.init_cache)."""
+    result = db.query(TABLES[table][1])
+    count = 0
+    rows = result.fetchmany(batch_size)
+    while rows:
+        for row in rows:
+            yield tuple(row)
+        count += len(rows)
+        rows = result.fetchmany(batch_size)
+    logger.info("Read %d %s from the database", count, table)
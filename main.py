@@ -1,26 +1,64 @@
 #!/usr/bin/env python
 
 import argparse
+import datetime
 import logging
 import os
+import sys
 
 import application
 import frontend
+from application.services import compression
 
 
 def parse_command_line_arguments():
     parser = argparse.ArgumentParser(description="Manage bank account information",
                                      epilog="Run with bokeh to use application in normal viewing mode: bokeh serve --show main.py")
-    parser.add_argument("-i", "--import-rabobank-csv", metavar="rabobank_csv_file", type=str,
-                        help="Import given Rabobank csv-file into the database")
+    parser.add_argument("-i", "--import-rabobank-csv", metavar="rabobank_csv_file", type=str, nargs="+",
+                        help="Import given Rabobank csv-files (or all csv-files in given directories) into the "
+                             "database")
     parser.add_argument("-e", "--export-data", type=str, metavar="native-directory",
-                        help="Export database contents to accounts.csv, categories.csv and transactions.csv in given directory")
+                        help="Export database contents to accounts.csv, categories.csv and transactions.csv in given "
+                             "directory, or export the table given by --table to stdout if the directory is '-'")
+    parser.add_argument("-t", "--table", choices=application.NATIVE_TABLES,
+                        help="Export only given table")
+    parser.add_argument("-z", "--compression", choices=sorted(compression.SUFFIXES),
+                        help="Compress the exported csv-files")
+    parser.add_argument("-f", "--format", choices=["csv", "binary"], default="csv",
+                        help="Format of the native export or import: csv-files, or a single column-oriented binary "
+                             "dump (%s) that is faster to export and import" % application.BINARY_DUMP_FILENAME)
     parser.add_argument("-n", "--import-data", type=str, metavar="native-directory",
-                        help="Import native csv-files from given directory into the database")
+                        help="Import native csv-files (optionally compressed) from given directory into the database")
+    parser.add_argument("-r", "--recategorize", action="store_true",
+                        help="Re-apply the transaction mappers to the transactions in the database (or to those "
+                             "between --start-date and --end-date), saving only the changed transactions")
+    parser.add_argument("--start-date", type=parse_date, metavar="YYYY-MM-DD",
+                        help="Only re-categorize transactions from given date (inclusive)")
+    parser.add_argument("--end-date", type=parse_date, metavar="YYYY-MM-DD",
+                        help="Only re-categorize transactions until given date (exclusive)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Write the changes that re-categorization would make to stdout (as csv), without saving "
+                             "them")
+    parser.add_argument("-p", "--processes", type=int,
+                        help="Number of processes that match transactions when re-categorizing (default: number of "
+                             "CPUs)")
     args = parser.parse_args()
     return args
 
 
+def parse_date(text):
+    return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def find_native_file(directory, table):
+    """Returns the (possibly compressed) native csv-file of given table in given directory."""
+    for suffix in [""] + sorted(compression.SUFFIXES.values()):
+        filename = os.path.join(directory, table + ".csv" + suffix)
+        if os.path.exists(filename):
+            return filename
+    return os.path.join(directory, table + ".csv")
+
+
 def main():
     logging.basicConfig(format='%(asctime)-15s %(levelname)-7s [%(name)s] %(message)s')
     logging.getLogger("").setLevel(logging.INFO)
@@ -31,26 +69,57 @@ def main():
     if args.import_data:
         application.initialize_application()
         logger.info(args)
-        account_file = os.path.join(args.import_data, "accounts.csv")
-        category_file = os.path.join(args.import_data, "categories.csv")
-        transaction_file = os.path.join(args.import_data, "transactions.csv")
+        if args.format == "binary":
+            dump_file = os.path.join(args.import_data, application.BINARY_DUMP_FILENAME)
+            logger.info("Importing binary dump: %s", dump_file)
+            application.import_native_binary(dump_file)
+            return
+        account_file = find_native_file(args.import_data, "accounts")
+        category_file = find_native_file(args.import_data, "categories")
+        transaction_file = find_native_file(args.import_data, "transactions")
         logger.info("Importing native csv-files: %s, %s and %s", account_file, category_file, transaction_file)
         application.import_native_data(account_file, transaction_file, category_file)
         return
 
     if args.export_data:
+        application.initialize_database()
+        if args.format == "binary":
+            if args.export_data == "-" or args.table or args.compression:
+                logger.error("Binary dumps hold all tables in one uncompressed file (which is read from a memory map)")
+                return
+            dump_file = os.path.join(args.export_data, application.BINARY_DUMP_FILENAME)
+            logger.info("Exporting binary dump to %s", dump_file)
+            application.export_native_binary(dump_file)
+            return
+        if args.export_data == "-":
+            if not args.table:
+                logger.error("Exporting to stdout requires a --table")
+                return
+            application.export_native_table(args.table, "-")
+            return
+        if args.compression and not compression.is_available(args.compression):
+            logger.error("Compression %s is not available (install the zstandard package)", args.compression)
+            return
+        suffix = args.compression and compression.SUFFIXES[args.compression] or ""
+        for table in args.table and [args.table] or application.NATIVE_TABLES:
+            filename = os.path.join(args.export_data, table + ".csv" + suffix)
+            logger.info("Exporting %s to %s", table, filename)
+            application.export_native_table(table, filename)
+        return
+
+    if args.recategorize:
         application.initialize_application()
-        account_file = os.path.join(args.export_data, "accounts.csv")
-        category_file = os.path.join(args.export_data, "categories.csv")
-        transaction_file = os.path.join(args.export_data, "transactions.csv")
-        logger.info("Exporting data to %s, %s and %s", account_file, transaction_file, category_file)
-        application.export_native_data(account_file, transaction_file, category_file)
+        logger.info("Re-categorizing transactions from %s until %s", args.start_date or "the start",
+                    args.end_date or "the end")
+        changes = application.recategorize_transactions(args.start_date, args.end_date, args.dry_run, args.processes)
+        if args.dry_run:
+            application.services.recategorization.write_report(changes, sys.stdout)
         return
 
     if args.import_rabobank_csv:
         application.initialize_application()
-        logger.info("Importing rabobank csv-file: %s", args.import_rabobank_csv)
-        application.import_rabobank_transactions([args.import_rabobank_csv])
+        logger.info("Importing rabobank csv-files: %s", args.import_rabobank_csv)
+        application.import_rabobank_transactions(args.import_rabobank_csv)
         return
 
     frontend.main()
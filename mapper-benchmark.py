@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import argparse
+import csv
+import datetime
+import decimal
+import logging
+import os
+import random
+import tempfile
+import time
+
+logging.basicConfig(format='%(asctime)-15s %(levelname)-7s [%(name)s] %(message)s')
+logging.getLogger("").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SYLLABLES = ["al", "ber", "hein", "jum", "bo", "zig", "go", "ne", "co", "ka", "ro", "mi", "ta", "lo", "ve", "su", "da",
+             "pi", "van", "de", "ster", "markt", "tank", "shop"]
+DESCRIPTIONS = ["Betaalautomaat pinpas", "Termijn", "Overboeking", "Incasso", "Online betaling", "Abonnement"]
+
+
+def generate_word():
+    return "".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4)))
+
+
+def generate_data(directory, rule_count, regex_fraction):
+    """Writes categories.txt and a mapping.csv with given number of rules to given directory. Returns the list of
+    (name, description, counter account) of the counterparties that the rules match."""
+    categories = ["Expenses::Group %d::Category %d" % (i // 10, i) for i in range(200)]
+    with open(os.path.join(directory, "categories.txt"), "w") as text:
+        text.write("\n".join(categories) + "\n")
+
+    counterparties = []
+    with open(os.path.join(directory, "mapping.csv"), "w", encoding="ISO-8859-1", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Category", "Name", "Description", "CounterAccount"])
+        for _ in range(rule_count):
+            name = " ".join(generate_word() for _ in range(random.randint(1, 3)))
+            description = random.choice(DESCRIPTIONS)
+            if random.random() < regex_fraction:
+                name_pattern = name.replace(" ", ".*")
+            else:
+                name_pattern = name
+            description_pattern = random.random() < 0.3 and description.split()[0].lower() or ""
+            writer.writerow([random.choice(categories), name_pattern, description_pattern, ""])
+            counterparties.append(("%s %d" % (name.upper(), random.randint(1, 9999)), description,
+                                   "NL%02dBANK%010d" % (random.randint(10, 99), random.getrandbits(32))))
+    return counterparties
+
+
+def generate_transactions(accounts, counterparties, count, unmatched_fraction):
+    """Creates (without saving) given number of transactions, of which the given fraction has a counterparty that
+    matches no rule. As in real bank statements, a few hundred counterparties account for most transactions."""
+    from domain.account_management.model.account import account_factory
+    transactions = []
+    for serial in range(count):
+        if random.random() < unmatched_fraction:
+            name, description, counter_account = generate_word().upper(), random.choice(DESCRIPTIONS), ""
+        else:
+            name, description, counter_account = counterparties[min(len(counterparties) - 1,
+                                                                    int(random.expovariate(1 / 200)))]
+        transactions.append(account_factory().create_transaction(
+            accounts[serial % len(accounts)], datetime.date(2010, 1, 1) + datetime.timedelta(days=serial // 20),
+            decimal.Decimal("%.2f" % random.uniform(-200, 200)), name, "%s %d" % (description, serial % 3), serial,
+            counter_account, decimal.Decimal("1000.00")))
+    return transactions
+
+
+def train_classifier(history):
+    """Trains the classifier with given transactions, categorized by the pattern mapper."""
+    import application
+    from application.services.transaction_mapping import get_best_scoring_category
+    pattern_mapper = application.services.Services.pattern_mapper()
+    for transaction in history:
+        transaction.category = get_best_scoring_category(pattern_mapper.get_category_scores(transaction))
+    application.services.Services.classifier_mapper().train(history)
+
+
+def replay(transactions, title):
+    """Runs given transactions through the categorization pipeline (without saving them), and logs the summary of
+    the mapper statistics."""
+    import application
+    pipeline = application.services.Services.categorization_pipeline()
+    start = time.perf_counter()
+    for transaction in transactions:
+        pipeline.evaluate(transaction)
+    duration = time.perf_counter() - start
+    logger.info("%s: %d transactions in %.3fs (%.0f transactions/s)", title, len(transactions), duration,
+                len(transactions) / duration)
+    logging.getLogger("application").setLevel(logging.INFO)
+    application.log_mapping_statistics()
+    logging.getLogger("application").setLevel(logging.WARNING)
+
+
+def main(rule_count, transaction_count, regex_fraction, unmatched_fraction):
+    """Replays synthetic transactions against a generated mapping.csv, with all mappers of the application, and reports
+    the calls, matches, decisions and latencies per mapper. The classifier is trained with another set of synthetic
+    transactions first. The second replay shows the effect of the memoized pattern scores."""
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.environ["DATA_DIRECTORY"] = directory
+        counterparties = generate_data(directory, rule_count, regex_fraction)
+
+        import application
+        from domain.account_management.model.account import account_factory, account_repository
+        application.initialize_application()
+        accounts = [account_factory().create_account("NL%02dRABO0123456789" % i, "Rabobank") for i in range(2)]
+        with account_repository().batch():
+            for account in accounts:
+                account_repository().save_account(account)
+        train_classifier(generate_transactions(accounts, counterparties, transaction_count, unmatched_fraction))
+        transactions = generate_transactions(accounts, counterparties, transaction_count, unmatched_fraction)
+        logger.info("Generated %d rules (%.0f%% with regular expressions) and %d transactions", rule_count,
+                    regex_fraction * 100, transaction_count)
+        replay(transactions, "First replay")
+        replay(transactions, "Second replay")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the transaction mappers")
+    parser.add_argument("-r", "--rules", type=int, default=5000, help="Number of rules in the generated mapping.csv")
+    parser.add_argument("-n", "--transactions", type=int, default=100000, help="Number of transactions to replay")
+    parser.add_argument("--regex-fraction", type=float, default=0.1,
+                        help="Fraction of the rules with a regular expression")
+    parser.add_argument("--unmatched-fraction", type=float, default=0.2,
+                        help="Fraction of the transactions that match no rule")
+    args = parser.parse_args()
+    main(args.rules, args.transactions, args.regex_fraction, args.unmatched_fraction)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import argparse
+import datetime
+import decimal
+import logging
+import random
+import tracemalloc
+
+from domain.account_management.model.account import Account, Transaction
+
+logging.basicConfig(format='%(asctime)-15s %(levelname)-7s [%(name)s] %(message)s')
+logging.getLogger("").setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+COUNTERPARTIES = [("ALBERT HEIJN 1234", "NL12RABO0123456789"), ("JUMBO SUPERMARKTEN", "NL34INGB0001234567"),
+                  ("ENECO SERVICES", "NL56ABNA0987654321"), ("WERKGEVER B.V.", "NL78RABO0192837465"),
+                  ("ZIGGO SERVICES BV", "NL90INGB0009876543"), ("NS REIZIGERS", "NL11ABNA0555666777")]
+
+
+class LegacyTransaction:
+    """Replica of the former Transaction memory layout: a plain object with a __dict__ and an eagerly allocated list
+    of domain events."""
+
+    def __init__(self, transaction_id, account, serial, date, amount, name, description,
+                 counter_account, balance_after, internal=False, category=None):
+        self.id = transaction_id
+        self._domain_events = []
+        self.account = account
+        self.serial = serial
+        self.date = date
+        self.amount = amount
+        self.name = name
+        self.description = description
+        self.counter_account = counter_account
+        self.balance_after = balance_after
+        self.internal = internal
+        self.category = category
+
+
+def generate_rows(count):
+    """Generates rows as they would be read from the database: every row holds freshly allocated strings."""
+    random.seed(0)
+    start = datetime.date(2005, 1, 1)
+    for serial in range(count):
+        name, counter_account = random.choice(COUNTERPARTIES)
+        yield ("%032x" % random.getrandbits(128), serial, start + datetime.timedelta(days=serial // 10),
+               decimal.Decimal("%.2f" % random.uniform(-200, 200)), "".join(name), "Termijn %d" % (serial % 12),
+               "".join(counter_account), decimal.Decimal("%.2f" % random.uniform(0, 10000)))
+
+
+def measure(transaction_class, account, count):
+    """Returns the number of bytes allocated per transaction when creating count transactions of given class."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    transactions = [transaction_class(transaction_id, account, serial, date, amount, name, description,
+                                      counter_account, balance_after)
+                    for (transaction_id, serial, date, amount, name, description, counter_account, balance_after) in
+                    generate_rows(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(transactions) == count
+    return (after - before) / count
+
+
+def main(count):
+    """Reports the memory used per transaction for the former and the current Transaction layout."""
+    account = Account("0" * 32, "NL01RABO0123456789", "Rabobank")
+    legacy = measure(LegacyTransaction, account, count)
+    current = measure(Transaction, account, count)
+    logger.info("Bytes per transaction (%d transactions, including row data):", count)
+    logger.info("    before (dict, eager event list, no interning): %7.1f", legacy)
+    logger.info("    after (slots, lazy event list, interning)    : %7.1f", current)
+    logger.info("    saved                                        : %6.1f%%", 100 * (legacy - current) / legacy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the memory footprint of Transaction entities")
+    parser.add_argument("-n", "--transactions", type=int, default=100000, help="Number of transactions to create")
+    main(parser.parse_args().transactions)
@@ -0,0 +1,58 @@
+import csv
+import io
+
+import pytest
+from dependency_injector import providers
+
+import application
+import application.services
+import infrastructure.repositories
+
+CATEGORIES = ["Overboekingen", "Uitgaven::Boodschappen", "Uitgaven::Wonen::Energie", "Inkomsten::Salaris"]
+MAPPING = [("Uitgaven::Boodschappen", "albert heijn", ""), ("Uitgaven::Wonen::Energie", "eneco", ""),
+           ("Inkomsten::Salaris", "werkgever", "")]
+RABOBANK_FIELDNAMES = ["IBAN/BBAN", "Volgnr", "Rentedatum", "Bedrag", "Naam tegenpartij", "Omschrijving-1",
+                       "Omschrijving-2", "Omschrijving-3", "Betalingskenmerk", "Tegenrekening IBAN/BBAN",
+                       "Saldo na trn"]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Initializes the application on an empty database in a temporary directory, with a few categories and mapping
+    rules."""
+    data_directory = tmp_path / "data"
+    data_directory.mkdir()
+    (data_directory / "categories.txt").write_text("\n".join(CATEGORIES) + "\n")
+    with open(str(data_directory / "mapping.csv"), "w", encoding="ISO-8859-1", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Category", "Name", "Description", "CounterAccount"])
+        writer.writerows([category, name, description, ""] for category, name, description in MAPPING)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATA_DIRECTORY", str(data_directory))
+    reset_services()
+    application.initialize_application()
+    yield application
+    infrastructure.repositories.blackboard.database().close()
+    reset_services()
+
+
+def reset_services():
+    for provider in application.services.Services.providers.values():
+        if isinstance(provider, providers.Singleton):
+            provider.reset()
+
+
+def rabobank_csv(rows):
+    """Returns a Rabobank csv export (a file-like object) of given (account, serial, date, amount, name,
+    counter_account, balance) rows."""
+    text = io.StringIO()
+    writer = csv.DictWriter(text, RABOBANK_FIELDNAMES)
+    writer.writeheader()
+    for account, serial, date, amount, name, counter_account, balance in rows:
+        writer.writerow({"IBAN/BBAN": account, "Volgnr": "%018d" % serial, "Rentedatum": date,
+                         "Bedrag": ("%+.2f" % amount).replace(".", ","), "Naam tegenpartij": name,
+                         "Omschrijving-1": "Omschrijving %d" % serial, "Omschrijving-2": "", "Omschrijving-3": "",
+                         "Betalingskenmerk": "", "Tegenrekening IBAN/BBAN": counter_account,
+                         "Saldo na trn": ("%+.2f" % balance).replace(".", ",")})
+    text.seek(0)
+    return text
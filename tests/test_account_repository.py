@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+import application.services
+import infrastructure.repositories
+from application.services.data_import import rabobank
+from domain.account_management.model.account import account_repository, account_factory, Transaction
+
+from conftest import rabobank_csv
+
+ACCOUNT = "NL01RABO0123456789"
+
+
+class FailingCategorizationPipeline:
+    def categorize_all(self, transactions, update=False):
+        raise RuntimeError("Categorization failed")
+
+
+def get_rows(count):
+    start = datetime.date(2020, 1, 1)
+    return [(ACCOUNT, serial, (start + datetime.timedelta(days=serial)).isoformat(), -10.0, "Albert Heijn %d" % serial,
+             "NL99BANK0000000001", 1000.0 - 10 * serial) for serial in range(1, count + 1)]
+
+
+def get_database_ids(table):
+    return {row[0] for row in infrastructure.repositories.blackboard.database().query("SELECT id FROM %s" % table)}
+
+
+def get_cached_transactions():
+    return [transaction for account in account_repository().get_accounts() for transaction in account.get_transactions()]
+
+
+def test_failed_import_is_rolled_back_and_can_be_retried(app):
+    with pytest.raises(RuntimeError):
+        rabobank.import_transactions_from_rabobank_text(rabobank_csv(get_rows(300)), app.RABOBANK,
+                                                        categorization_pipeline=FailingCategorizationPipeline())
+    assert get_database_ids("transactions") == set()
+    assert get_database_ids("accounts") == set()
+    assert get_cached_transactions() == []
+    assert not account_repository().get_accounts()
+
+    statistics = rabobank.import_transactions_from_rabobank_text(
+        rabobank_csv(get_rows(300)), app.RABOBANK,
+        categorization_pipeline=application.services.Services.categorization_pipeline())
+    assert (statistics.inserted, statistics.duplicates) == (300, 0)
+    transactions = get_cached_transactions()
+    assert {t.id for t in transactions} == get_database_ids("transactions")
+    assert all(account_repository().get_transaction(t.id) is t for t in transactions)
+    assert {a.id for a in account_repository().get_accounts()} == get_database_ids("accounts")
+
+
+def test_failed_batch_restores_changed_transactions(app):
+    rabobank.import_transactions_from_rabobank_text(
+        rabobank_csv(get_rows(3)), app.RABOBANK,
+        categorization_pipeline=application.services.Services.categorization_pipeline())
+    transaction = get_cached_transactions()[0]
+    category = transaction.category
+    assert category and not transaction.internal
+
+    with pytest.raises(RuntimeError):
+        with account_repository().batch():
+            transaction.update_category(None)
+            transaction.set_internal(True)
+            account_repository().save_transaction(transaction)
+            raise RuntimeError("Batch failed")
+    assert transaction.category is category
+    assert not transaction.internal
+    assert not transaction.flush_domain_events()
+
+
+def test_failed_insert_leaves_cache_empty(app):
+    account = account_factory().create_account(ACCOUNT, app.RABOBANK)
+    account_repository().save_account(account)
+
+    def create_transactions():
+        for serial in range(1, 26):
+            yield Transaction("%032x" % serial, account, serial, datetime.date(2020, 1, serial), -10, "Eneco", "",
+                              "", 1000, False, None)
+        raise ValueError("Corrupt dump")
+
+    with pytest.raises(ValueError):
+        account_repository().insert_transactions(create_transactions(), batch_size=10)
+    assert get_database_ids("transactions") == set()
+    assert get_cached_transactions() == []
@@ -0,0 +1,54 @@
+import pytest
+
+import infrastructure.repositories
+import infrastructure.repositories.category_repository
+from domain.account_management.model.category import category_repository, category_factory, \
+    get_category_tree_version
+
+
+def test_failed_batch_removes_new_categories(app):
+    categories = set(category_repository().get_categories())
+    parent = category_repository().get_category_by_qualified_name("Uitgaven")
+    with pytest.raises(RuntimeError):
+        with category_repository().batch():
+            category_repository().save_category(category_factory().create_category_from_qualified_name(
+                "Uitgaven::Vrije tijd::Sport"))
+            raise RuntimeError("Batch failed")
+    assert set(category_repository().get_categories()) == categories
+    assert category_repository().get_category_by_qualified_name("Uitgaven::Vrije tijd") is None
+    assert "Vrije tijd" not in [c.name for c in parent.children]
+    assert len(infrastructure.repositories.blackboard.database().query("SELECT id FROM categories").fetchall()) == \
+        len(categories)
+
+
+def test_creating_categories_does_not_change_the_tree_version(app):
+    version = get_category_tree_version()
+    existing = category_factory().create_category_from_qualified_name("Uitgaven::Wonen::Energie")
+    assert existing is category_repository().get_category_by_qualified_name("Uitgaven::Wonen::Energie")
+    new = category_factory().create_category_from_qualified_name("Uitgaven::Wonen::Water::Drinkwater")
+    assert new.qualified_name == "Uitgaven::Wonen::Water::Drinkwater"
+    assert new.parent.parent is category_repository().get_category_by_qualified_name("Uitgaven::Wonen")
+    category_repository().save_category(new)
+    assert category_repository().get_category_by_qualified_name("Uitgaven::Wonen::Water::Drinkwater") is new
+    assert get_category_tree_version() == version
+
+
+def test_category_tree_is_numbered_once_per_batch(app, monkeypatch):
+    numberings = []
+    number_category_tree = infrastructure.repositories.category_repository.number_category_tree
+    monkeypatch.setattr(infrastructure.repositories.category_repository, "number_category_tree",
+                        lambda categories: numberings.append(1) or number_category_tree(categories))
+    uitgaven = category_repository().get_category_by_qualified_name("Uitgaven")
+    with category_repository().batch():
+        for qualified_name in ["Uitgaven::Vrije tijd::Sport", "Uitgaven::Vrije tijd::Reizen", "Inkomsten::Rente"]:
+            category = category_factory().create_category_from_qualified_name(qualified_name)
+            category_repository().save_category(category)
+            assert category.inherits_from(category.parent)
+        assert category_repository().get_category_by_qualified_name("Uitgaven::Vrije tijd::Sport").inherits_from(
+            uitgaven)
+        assert numberings == []
+    assert len(numberings) == 1
+    sport = category_repository().get_category_by_qualified_name("Uitgaven::Vrije tijd::Sport")
+    assert sport.tree_interval and uitgaven.tree_interval
+    assert sport.inherits_from(uitgaven)
+    assert not sport.inherits_from(category_repository().get_category_by_qualified_name("Inkomsten"))
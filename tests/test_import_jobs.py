@@ -0,0 +1,63 @@
+import datetime
+import threading
+import time
+
+import application.services
+import frontend
+from application.services import import_jobs
+
+from conftest import rabobank_csv
+
+ACCOUNT = "NL01RABO0123456789"
+
+
+def write_upload(tmp_path, count):
+    rows = [(ACCOUNT, serial, (datetime.date(2000, 1, 1) + datetime.timedelta(days=serial)).isoformat(), -10.0,
+             "Winkel %d" % (serial % 50), "NL99BANK%010d" % (serial % 50), 100000.0 - 10 * serial)
+            for serial in range(1, count + 1)]
+    filename = tmp_path / "upload.csv"
+    filename.write_text(rabobank_csv(rows).getvalue())
+    return str(filename)
+
+
+def test_services_can_be_read_while_a_job_imports(app, tmp_path):
+    errors = []
+    finished = threading.Event()
+
+    def read_services():
+        while not finished.is_set():
+            try:
+                dates = application.services.get_transaction_date_range()
+                application.services.get_income_expenses_profit_loss(dates)
+                application.services.get_combined_amount_series_for_category(None, dates)
+                application.services.get_combined_balance_series(dates)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read_services) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    job = app.start_rabobank_import_job(write_upload(tmp_path, 5000))
+    while job.state in (import_jobs.QUEUED, import_jobs.RUNNING):
+        time.sleep(0.01)
+    finished.set()
+    for reader in readers:
+        reader.join()
+
+    assert job.state == import_jobs.FINISHED
+    assert job.statistics.inserted == 5000
+    assert errors == []
+
+
+def test_upload_is_removed_if_no_job_can_be_started(app, tmp_path, monkeypatch):
+    def start_rabobank_import_job(filename):
+        raise RuntimeError("No jobs")
+
+    upload_directory = tmp_path / "uploads"
+    upload_directory.mkdir()
+    monkeypatch.setattr("tempfile.tempdir", str(upload_directory))
+    monkeypatch.setattr(app, "start_rabobank_import_job", start_rabobank_import_job)
+    response = frontend.app.test_client().put("/upload", data=b"IBAN/BBAN,Volgnr\n")
+    assert response.status_code == 400
+    assert list(upload_directory.iterdir()) == []
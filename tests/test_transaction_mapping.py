@@ -0,0 +1,43 @@
+import application.services
+from application.services.data_import import rabobank
+from domain.account_management.model.account import account_repository
+
+from conftest import rabobank_csv
+
+PAYMENTS = "NL01RABO0123456789"
+SAVINGS = "NL02RABO0987654321"
+CREDIT_CARD = "NL03RABO0555555555"
+
+
+def import_rows(app, rows):
+    return rabobank.import_transactions_from_rabobank_text(
+        rabobank_csv(rows), app.RABOBANK,
+        categorization_pipeline=application.services.Services.categorization_pipeline())
+
+
+def test_import_flags_transfers_to_accounts_created_by_the_same_import(app):
+    # An earlier import, which makes the internal transaction detector collect the identifiers of the own accounts
+    import_rows(app, [(CREDIT_CARD, 1, "2019-12-31", -10.0, "Albert Heijn", "NL99BANK0000000001", -10.0)])
+    rows = []
+    for serial in range(1, 11):
+        date = "2020-01-%02d" % serial
+        rows.append((PAYMENTS, serial, date, -50.0, "Spaarrekening", SAVINGS, 1000.0 - 50 * serial))
+        rows.append((SAVINGS, serial, date, 50.0, "Betaalrekening", PAYMENTS, 50.0 * serial))
+    rows.append((PAYMENTS, 11, "2020-01-11", -25.0, "Albert Heijn", "NL99BANK0000000001", 475.0))
+
+    import_rows(app, rows)
+    transactions = [t for account in account_repository().get_accounts() for t in account.get_transactions()]
+    internal = [t for t in transactions if t.internal]
+    assert len(transactions) == 22
+    assert len(internal) == 20
+    assert all(t.category and t.category.qualified_name == "Overboekingen" for t in internal)
+
+
+def test_import_records_mapping_statistics(app):
+    statistics = application.services.Services.mapping_statistics()
+    import_rows(app, [(PAYMENTS, 1, "2020-01-01", -25.0, "Albert Heijn 1234", "NL99BANK0000000001", 975.0),
+                      (PAYMENTS, 2, "2020-01-02", -80.0, "Eneco", "NL99BANK0000000002", 895.0),
+                      (PAYMENTS, 3, "2020-01-03", -5.0, "Kiosk", "", 890.0)])
+    assert (statistics.transactions, statistics.undecided) == (3, 1)
+    pattern_statistics = statistics.get_mapper_statistics(application.services.Services.memoized_pattern_mapper())
+    assert (pattern_statistics.calls, pattern_statistics.matches, pattern_statistics.decisive) == (3, 2, 2)